@@ -0,0 +1,962 @@
+#!/opt/homebrew/bin/python3
+
+import argparse
+import hashlib
+import json
+import marshal
+import os
+import random
+import re
+import sys
+import time
+from array import array
+from collections import namedtuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# tokens of HDL: range dots, numbers, names and single punctuations
+TOKEN = re.compile(r'\.\.|\d+|[A-Za-z_]\w*|[{}()\[\],;:=]')
+# folders searched for parts, after the folder of the chip itself
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SEARCH = [os.path.join(ROOT, folder) for folder in ('01', '02', '03/a', '03/b', '05')]
+# builtin-only chips that behave like an implemented chip
+ALIASES = {'ARegister': 'Register', 'DRegister': 'Register'}
+# constant wires, every other wire is numbered after them
+FALSE, TRUE = 0, 1
+# default bound on flattened Nand gates, larger designs need word-level parts
+LIMIT = 200000
+# input bits covered in one verification pass, wider sweeps run in chunks of this many lanes
+CHUNK = 16
+# chips whose state is visible to test scripts as Name[] or Name[index]
+STATEFUL = {'Register', 'ARegister', 'DRegister', 'PC', 'RAM8', 'RAM64', 'RAM512', 'RAM4K', 'RAM16K',
+            'ROM32K', 'Screen', 'Keyboard'}
+
+# parsed CHIP definition, pins are name -> width dicts,
+# parts are (chip name, [(pin, lo, hi, wire, wire lo, wire hi)]) with None for unsliced pins
+Chip = namedtuple('Chip', ['name', 'inputs', 'outputs', 'parts'])
+
+
+# chip design too large to be flattened to Nand gates
+class NetlistTooLarge(Exception):
+    pass
+
+
+# parse one .hdl file into a Chip
+class Parser:
+
+    def __init__(self, source) -> None:
+        source = re.sub(r'/\*.*?\*/', '', source, flags=re.S)
+        source = re.sub(r'//[^\n]*', '', source)
+        self.tokens = TOKEN.findall(source)
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def next(self, expected=None):
+        token = self.peek()
+        assert expected is None or token == expected, f'expected {expected} but got {token}'
+        self.pos += 1
+        return token
+
+    def parse(self):
+        self.next('CHIP')
+        name = self.next()
+        self.next('{')
+        inputs = self.pins('IN')
+        outputs = self.pins('OUT')
+        self.next('PARTS')
+        self.next(':')
+        parts = []
+        while self.peek() != '}':
+            parts.append(self.part())
+        return Chip(name, inputs, outputs, parts)
+
+    # pin declarations after IN or OUT, e.g. a[16], b;
+    def pins(self, keyword):
+        pins = {}
+        if self.peek() != keyword:
+            return pins
+        self.next()
+        while True:
+            name = self.next()
+            width = 1
+            if self.peek() == '[':
+                self.next()
+                width = int(self.next())
+                self.next(']')
+            pins[name] = width
+            if self.next() == ';':
+                return pins
+
+    # one part, e.g. Mux16(a=x, b[0..7]=y, sel=true, out=z);
+    def part(self):
+        name = self.next()
+        self.next('(')
+        connections = []
+        while True:
+            pin, lo, hi = self.pin()
+            self.next('=')
+            wire, wlo, whi = self.pin()
+            connections.append((pin, lo, hi, wire, wlo, whi))
+            if self.next() == ')':
+                break
+        self.next(';')
+        return name, connections
+
+    # pin name with optional [i] or [i..j] subscript
+    def pin(self):
+        name = self.next()
+        if self.peek() != '[':
+            return name, None, None
+        self.next()
+        lo = hi = int(self.next())
+        if self.peek() == '..':
+            self.next()
+            hi = int(self.next())
+        self.next(']')
+        return name, lo, hi
+
+
+# word-level builtin chips, each with a single 16-bit "out" pin;
+# read() takes the combinational inputs, tick() samples every input and tock() commits
+class ROM32K:
+    inputs = {'address': 15}
+    combinational = ('address',)
+
+    def __init__(self) -> None:
+        self.words = array('H', bytes(2 * 32768))
+
+    def load(self, hackfile):
+        with open(hackfile, 'r') as f:
+            for i, line in enumerate(line.strip() for line in f if line.strip()):
+                self.words[i] = int(line, 2)
+
+    def read(self, address):
+        return self.words[address]
+
+    def get(self, index):
+        return self.words[int(index)]
+
+    def set(self, index, value):
+        self.words[int(index)] = value & 0xFFFF
+
+    def tick(self, pins):
+        pass
+
+    def tock(self):
+        pass
+
+
+# keyboard without a keyboard attached, scripts waiting for a key are interactive
+class Keyboard:
+    inputs = {}
+    combinational = ()
+    interactive = True
+
+    def read(self):
+        return 0
+
+    def get(self, index=None):
+        return 0
+
+    def tick(self, pins):
+        pass
+
+    def tock(self):
+        pass
+
+
+# word-level register, it takes its new value on tick and shows it on out from tock
+class Register:
+    inputs = {'in': 16, 'load': 1}
+    combinational = ()
+
+    def __init__(self) -> None:
+        self.value = 0
+        self.pending = None
+
+    def read(self):
+        return self.value
+
+    # value held by the register, index is ignored as in Register[] and Register[0]
+    def get(self, index=None):
+        return self.value if self.pending is None else self.pending
+
+    def set(self, index, value):
+        self.value = value
+
+    def tick(self, pins):
+        self.pending = pins['in'] if pins['load'] else self.value
+
+    def tock(self):
+        if self.pending is not None:
+            self.value = self.pending
+            self.pending = None
+
+
+# word-level program counter, reset takes priority over load, and load over inc
+class PC(Register):
+    inputs = {'in': 16, 'load': 1, 'inc': 1, 'reset': 1}
+
+    def tick(self, pins):
+        if pins['reset']:
+            self.pending = 0
+        elif pins['load']:
+            self.pending = pins['in']
+        elif pins['inc']:
+            self.pending = (self.value + 1) & 0xFFFF
+        else:
+            self.pending = self.value
+
+
+# word-level RAM of one 16-bit array entry per word, read combinationally and written on the clock
+class RAM:
+    inputs = {'in': 16, 'load': 1, 'address': 3}
+    combinational = ('address',)
+
+    def __init__(self) -> None:
+        self.words = array('H', bytes(2 << self.inputs['address']))
+        self.pending = None
+
+    def read(self, address):
+        return self.words[address]
+
+    # word held at index, a write is visible from tick
+    def get(self, index):
+        if self.pending and self.pending[0] == int(index):
+            return self.pending[1]
+        return self.words[int(index)]
+
+    def set(self, index, value):
+        self.words[int(index)] = value & 0xFFFF
+
+    def tick(self, pins):
+        self.pending = (pins['address'], pins['in']) if pins['load'] else None
+
+    def tock(self):
+        if self.pending:
+            self.words[self.pending[0]] = self.pending[1]
+            self.pending = None
+
+
+class RAM8(RAM):
+    inputs = {'in': 16, 'load': 1, 'address': 3}
+
+
+class RAM64(RAM):
+    inputs = {'in': 16, 'load': 1, 'address': 6}
+
+
+class RAM512(RAM):
+    inputs = {'in': 16, 'load': 1, 'address': 9}
+
+
+class RAM4K(RAM):
+    inputs = {'in': 16, 'load': 1, 'address': 12}
+
+
+class RAM16K(RAM):
+    inputs = {'in': 16, 'load': 1, 'address': 14}
+
+
+# 8K words of screen memory
+class Screen(RAM):
+    inputs = {'in': 16, 'load': 1, 'address': 13}
+
+
+# builtin chip models by name, Nand and DFF are the gate-level primitives
+MODELS = {'ROM32K': ROM32K, 'Screen': Screen, 'Keyboard': Keyboard}
+# models substituted for parts implemented in project 03, so large memories take one word per word
+WORDLEVEL = {'Register': Register, 'PC': PC, 'RAM8': RAM8, 'RAM64': RAM64, 'RAM512': RAM512, 'RAM4K': RAM4K,
+             'RAM16K': RAM16K}
+PRIMITIVES = {
+    'Nand': Chip('Nand', {'a': 1, 'b': 1}, {'out': 1}, []),
+    'DFF': Chip('DFF', {'in': 1}, {'out': 1}, []),
+}
+
+
+# flatten a chip hierarchy to Nand gates, DFFs and word-level builtin parts,
+# wires are single bits numbered from 2, after the FALSE and TRUE constants;
+# wordlevel substitutes models for the Register, PC and RAM parts below the chip: always when True,
+# never when False, and by default only when the gate-level netlist would exceed the limit
+class Netlist:
+
+    def __init__(self, hdlfile, limit=LIMIT, cachedir=None, wordlevel=None) -> None:
+        self.folder = os.path.dirname(os.path.abspath(hdlfile))
+        self.limit = limit
+        self.wordlevel = wordlevel
+        # digest of every .hdl file read and the search candidates found missing,
+        # the compiled netlist stays valid as long as both are unchanged
+        self.files = {}
+        self.missing = []
+        self.cachefile = None
+        if cachedir:
+            name = hashlib.sha256(f'{os.path.abspath(hdlfile)}:{limit}:{wordlevel}'.encode()).hexdigest()
+            self.cachefile = os.path.join(cachedir, name + '.marshal')
+            if self.restore():
+                return
+        self.chips = {}
+        self.parent = [FALSE, TRUE]
+        self.gates = []
+        self.dffs = []
+        self.parts = []
+        # index of the top-level part each gate, DFF and builtin part comes from, not kept in the cache
+        self.owners = {'gates': [], 'dffs': [], 'parts': []}
+        # stateful part instances by chip name, for variables such as DRegister[],
+        # output wires of gate-level instances and part index of word-level ones
+        self.instances = {}
+        top = self.chip(os.path.splitext(os.path.basename(hdlfile))[0], hdlfile)
+        self.name = top.name
+        if self.wordlevel is None:
+            self.wordlevel = self.count(top.name, {}) > limit
+        self.inputs = {pin: self.fresh(width) for pin, width in top.inputs.items()}
+        self.outputs = {pin: self.fresh(width) for pin, width in top.outputs.items()}
+        self.instantiate(top.name, {**self.inputs, **self.outputs})
+        self.renumber()
+        self.sort()
+        self.code = compile(self.source(), f'<{self.name}>', 'exec')
+        if self.cachefile:
+            self.save()
+
+    # content hash of the simulator and every source file, with the Python version for marshal
+    def key(self):
+        with open(__file__, 'rb') as f:
+            digest = hashlib.sha256(f.read() + sys.version.encode())
+        for path, content in sorted(self.files.items()):
+            digest.update(f'{path}:{content}'.encode())
+        return digest.hexdigest()
+
+    @staticmethod
+    def digest(path):
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
+    # load the compiled netlist of an earlier run, if no source file changed since then
+    def restore(self):
+        if not os.path.exists(self.cachefile):
+            return False
+        with open(self.cachefile, 'rb') as f:
+            key, self.files, self.missing, data, self.code = marshal.load(f)
+        if any(os.path.exists(path) for path in self.missing):
+            return False
+        try:
+            if any(self.digest(path) != content for path, content in self.files.items()):
+                return False
+        except OSError:
+            return False
+        if key != self.key():
+            return False
+        self.name, self.inputs, self.outputs, self.gates, self.dffs, parts, self.instances, self.wires, self.order = data
+        self.parts = [({**MODELS, **WORDLEVEL}[model](), pins) for model, pins in parts]
+        return True
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.cachefile), exist_ok=True)
+        parts = [(type(model).__name__, pins) for model, pins in self.parts]
+        data = (self.name, self.inputs, self.outputs, self.gates, self.dffs, parts, self.instances, self.wires,
+                self.order)
+        tmp = f'{self.cachefile}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            marshal.dump((self.key(), self.files, self.missing, data, self.code), f)
+        os.replace(tmp, self.cachefile)
+
+    # parsed definition of a chip by name, searched in the chip's folder, the project folders and builtins
+    def chip(self, name, hdlfile=None):
+        if name in self.chips:
+            return self.chips[name]
+        if name in PRIMITIVES:
+            chip = PRIMITIVES[name]
+        elif name in MODELS:
+            chip = Chip(name, MODELS[name].inputs, {'out': 16}, [])
+        else:
+            if hdlfile is None:
+                hdlfile = self.locate(name)
+            with open(hdlfile, 'rb') as f:
+                source = f.read()
+            self.files[os.path.abspath(hdlfile)] = hashlib.sha256(source).hexdigest()
+            chip = Parser(source.decode()).parse()
+        self.chips[name] = chip
+        return chip
+
+    # .hdl file of a chip, the first found in the chip's folder and the project folders
+    def locate(self, name):
+        source = ALIASES.get(name, name) + '.hdl'
+        candidates = [os.path.join(folder, source) for folder in [self.folder] + SEARCH]
+        found = [candidate for candidate in candidates if os.path.exists(candidate)]
+        assert found, f'chip {name} not found'
+        self.missing += candidates[:candidates.index(found[0])]
+        return found[0]
+
+    # Nand gates of a chip flattened all the way down, without building its netlist
+    def count(self, name, counts):
+        name = ALIASES.get(name, name)
+        if name not in counts:
+            if name == 'Nand':
+                counts[name] = 1
+            elif name == 'DFF' or name in MODELS:
+                counts[name] = 0
+            else:
+                counts[name] = sum(self.count(partname, counts) for partname, _ in self.chip(name).parts)
+        return counts[name]
+
+    def substituted(self, name):
+        return self.wordlevel and ALIASES.get(name, name) in WORDLEVEL
+
+    def fresh(self, width):
+        wires = list(range(len(self.parent), len(self.parent) + width))
+        self.parent += wires
+        return wires
+
+    def find(self, wire):
+        while self.parent[wire] != wire:
+            self.parent[wire] = self.parent[self.parent[wire]]
+            wire = self.parent[wire]
+        return wire
+
+    # connect two wires, constants stay the representative of their set
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a != b:
+            if b <= TRUE:
+                a, b = b, a
+            assert a > TRUE or b > TRUE, 'constants connected together'
+            self.parent[b] = a
+
+    # expand one chip instance, pins maps each pin of the chip to its wires
+    def instantiate(self, name, pins, owner=None):
+        if name == 'Nand':
+            if len(self.gates) >= self.limit:
+                raise NetlistTooLarge(f'{self.name} exceeds {self.limit} Nand gates')
+            self.gates.append((pins['a'][0], pins['b'][0], pins['out'][0]))
+            self.owners['gates'].append(owner)
+            return
+        if name == 'DFF':
+            self.dffs.append((pins['in'][0], pins['out'][0]))
+            self.owners['dffs'].append(owner)
+            return
+        if name in MODELS:
+            self.parts.append((MODELS[name](), pins))
+            self.owners['parts'].append(owner)
+            return
+        chip = self.chip(name)
+        local = dict(pins)
+        for index, (partname, connections) in enumerate(chip.parts):
+            part = self.chip(partname)
+            if self.substituted(partname):
+                part = Chip(partname, WORDLEVEL[ALIASES.get(partname, partname)].inputs, {'out': 16}, [])
+            partpins = {pin: [FALSE] * width for pin, width in part.inputs.items()}
+            partpins.update({pin: self.fresh(width) for pin, width in part.outputs.items()})
+            for pin, lo, hi, wire, wlo, whi in connections:
+                assert pin in partpins, f'{partname} has no pin {pin}'
+                lo, hi = (0, len(partpins[pin]) - 1) if lo is None else (lo, hi)
+                width = hi - lo + 1
+                if pin in part.inputs:
+                    if wire in ('true', 'false'):
+                        bits = [TRUE if wire == 'true' else FALSE] * width
+                    else:
+                        if wire not in local:
+                            local[wire] = self.fresh(width)
+                        bits = local[wire] if wlo is None else local[wire][wlo:whi + 1]
+                    assert len(bits) == width, f'width mismatch of {partname}.{pin}={wire} in {name}'
+                    partpins[pin][lo:hi + 1] = bits
+                else:
+                    assert wire not in chip.inputs, f'{partname}.{pin} drives input {wire} of {name}'
+                    bits = partpins[pin][lo:hi + 1]
+                    if wire not in local:
+                        local[wire] = list(bits)
+                        continue
+                    targets = local[wire] if wlo is None else local[wire][wlo:whi + 1]
+                    assert len(targets) == width, f'width mismatch of {partname}.{pin}={wire} in {name}'
+                    for a, b in zip(bits, targets):
+                        self.union(a, b)
+            if partname in STATEFUL:
+                model = partname in MODELS or self.substituted(partname)
+                self.instances.setdefault(partname, []).append(len(self.parts) if model else partpins['out'])
+            if self.substituted(partname):
+                self.parts.append((WORDLEVEL[ALIASES.get(partname, partname)](), partpins))
+                self.owners['parts'].append(index if owner is None else owner)
+            else:
+                self.instantiate(ALIASES.get(partname, partname), partpins, index if owner is None else owner)
+
+    # replace wires by their representatives, numbered densely
+    def renumber(self):
+        numbers = {FALSE: FALSE, TRUE: TRUE}
+
+        def number(wire):
+            root = self.find(wire)
+            if root not in numbers:
+                numbers[root] = len(numbers)
+            return numbers[root]
+
+        def pins(wires):
+            return {pin: [number(wire) for wire in bits] for pin, bits in wires.items()}
+        self.inputs = pins(self.inputs)
+        self.outputs = pins(self.outputs)
+        self.gates = [tuple(number(wire) for wire in gate) for gate in self.gates]
+        self.dffs = [tuple(number(wire) for wire in dff) for dff in self.dffs]
+        self.parts = [(model, pins(wires)) for model, wires in self.parts]
+        self.instances = {name: [entry if isinstance(entry, int) else [number(wire) for wire in entry]
+                                 for entry in instances] for name, instances in self.instances.items()}
+        self.wires = len(numbers)
+        self.parent = None
+
+    # order gates and builtin parts so every wire is computed before it is read,
+    # sources are constants, chip inputs, DFF outputs and undriven wires
+    def sort(self):
+        nodes = [(gate[:2], [gate[2]]) for gate in self.gates]
+        nodes += [([wire for pin in model.combinational for wire in wires[pin]], wires['out'])
+                  for model, wires in self.parts]
+        driver = {}
+        for i, (_, outputs) in enumerate(nodes):
+            for wire in outputs:
+                assert wire not in driver and wire > TRUE, f'wire {wire} driven twice'
+                driver[wire] = i
+        readers = [[] for _ in nodes]
+        pending = [0] * len(nodes)
+        for i, (inputs, _) in enumerate(nodes):
+            for wire in set(inputs):
+                if wire in driver:
+                    readers[driver[wire]].append(i)
+                    pending[i] += 1
+        ready = [i for i in range(len(nodes)) if not pending[i]]
+        order = []
+        while ready:
+            i = ready.pop()
+            order.append(i)
+            for j in readers[i]:
+                pending[j] -= 1
+                if not pending[j]:
+                    ready.append(j)
+        assert len(order) == len(nodes), f'combinational loop in {self.name}'
+        self.order = order
+
+    # python source of the straight-line evaluate, latch and commit functions
+    def source(self):
+        gates = len(self.gates)
+        # wires kept in the values list: pins, part inputs, DFF inputs and instance pins
+        observed = {wire for wires in self.outputs.values() for wire in wires}
+        observed |= {wire for _, pins in self.parts for wires in pins.values() for wire in wires}
+        observed |= {wire for wire, _ in self.dffs}
+        observed |= {wire for instances in self.instances.values() for wires in instances
+                     if not isinstance(wires, int) for wire in wires}
+        produced = {gate[2] for gate in self.gates}
+        produced |= {wire for _, pins in self.parts for wire in pins['out']}
+        read = {wire for gate in self.gates for wire in gate[:2]}
+        read |= {wire for model, pins in self.parts for pin in model.combinational for wire in pins[pin]}
+        lines = ['def evaluate(v, M, P):', '    w0 = 0', '    w1 = v[1] = M']
+        lines += [f'    w{wire} = v[{wire}]' for wire in sorted((read | observed) - produced) if wire > TRUE]
+        for i in self.order:
+            if i < gates:
+                a, b, out = self.gates[i]
+                lines.append(f'    w{out} = M ^ (w{a} & w{b})')
+                continue
+            model, pins = self.parts[i - gates]
+            words = ', '.join(' | '.join(f'w{wire} << {bit}' for bit, wire in enumerate(pins[pin]))
+                              for pin in model.combinational)
+            lines.append(f'    r = P[{i - gates}].read({words})')
+            lines += [f'    w{wire} = r >> {bit} & 1' for bit, wire in enumerate(pins['out'])]
+        lines += [f'    v[{wire}] = w{wire}' for wire in sorted(observed & produced)]
+        lines.append('    return v')
+        ins = ''.join(f'v[{wire}], ' for wire, _ in self.dffs)
+        outs = ''.join(f'v[{wire}], ' for _, wire in self.dffs)
+        lines.append('def latch(v):')
+        lines.append(f'    return ({ins})')
+        lines.append('def commit(v, s):')
+        lines.append(f'    ({outs}) = s' if outs else '    pass')
+        return '\n'.join(lines) + '\n'
+
+
+# compiled evaluator of a netlist, every wire holds one bit per lane,
+# so one pass of the Nand gates evaluates as many test vectors as there are lanes
+class Simulator:
+
+    # crosscheck runs every word-level model beside the netlist of its own HDL, comparing them every
+    # crosscheck cycles
+    def __init__(self, netlist, crosscheck=0, cachedir=None) -> None:
+        self.netlist = netlist
+        self.parts = [(model, pins) for model, pins in netlist.parts]
+        if crosscheck:
+            self.parts = [(CrossCheck(model, netlist.locate(type(model).__name__), crosscheck, cachedir)
+                           if type(model).__name__ in WORDLEVEL else model, pins) for model, pins in self.parts]
+        self.models = [model for model, _ in self.parts]
+        self.values = [0] * netlist.wires
+        self.mask = 1
+        self.latched = None
+        # index of each DFF by its output wire, for the state sampled between tick and tock
+        self.state = {out: i for i, (_, out) in enumerate(netlist.dffs)}
+        namespace = {}
+        exec(netlist.code, namespace)
+        self.evaluate = namespace['evaluate']
+        self.latch = namespace['latch']
+        self.commit = namespace['commit']
+
+    # evaluate lanes test vectors at once, each given as a pin -> value dict
+    def run(self, vectors):
+        lanes = len(vectors)
+        self.mask = (1 << lanes) - 1
+        for pin, wires in self.netlist.inputs.items():
+            for bit, wire in enumerate(wires):
+                packed = 0
+                for lane, vector in enumerate(vectors):
+                    packed |= ((vector.get(pin, 0) >> bit) & 1) << lane
+                self.values[wire] = packed
+        self.evaluate(self.values, self.mask, self.models)
+        return [{pin: self.get(pin, lane) for pin in self.netlist.outputs} for lane in range(lanes)]
+
+    # single-lane pin access, used by sequential simulation
+    def set(self, pin, value):
+        for bit, wire in enumerate(self.netlist.inputs[pin]):
+            self.values[wire] = (value >> bit) & 1
+
+    def get(self, pin, lane=0):
+        wires = self.netlist.inputs.get(pin) or self.netlist.outputs[pin]
+        return self.word(wires, lane)
+
+    # value of a bus in one lane, 16-bit buses are signed
+    def word(self, wires, lane=0):
+        value = 0
+        for bit, wire in enumerate(wires):
+            value |= ((self.values[wire] >> lane) & 1) << bit
+        return value - 0x10000 if len(wires) == 16 and value & 0x8000 else value
+
+    # value held by a register, which takes its new value on tick while its output waits for tock
+    def held(self, wires, lane=0):
+        if self.latched is None:
+            return self.word(wires, lane)
+        value = 0
+        for bit, wire in enumerate(wires):
+            bits = self.latched[self.state[wire]] if wire in self.state else self.values[wire]
+            value |= ((bits >> lane) & 1) << bit
+        return value - 0x10000 if len(wires) == 16 and value & 0x8000 else value
+
+    def eval(self):
+        self.evaluate(self.values, self.mask, self.models)
+
+    # rising edge: settle the logic and sample DFF and builtin part inputs
+    def tick(self):
+        self.eval()
+        self.latched = self.latch(self.values)
+        for model, pins in self.parts:
+            model.tick({pin: self.word(wires) & 0xFFFF for pin, wires in pins.items() if pin != 'out'})
+
+    # falling edge: outputs take the sampled values
+    def tock(self):
+        if self.latched is None:
+            self.tick()
+        self.commit(self.values, self.latched)
+        for model in self.models:
+            model.tock()
+        self.latched = None
+        self.eval()
+
+
+# word-level model shadowed by the netlist of its HDL, fed with the same inputs every cycle;
+# every interval cycles the output and one random word are compared, until the state is set directly
+class CrossCheck:
+
+    def __init__(self, model, hdlfile, interval, cachedir=None) -> None:
+        self.model = model
+        self.shadow = Simulator(Netlist(hdlfile, cachedir=cachedir))
+        self.name = self.shadow.netlist.name
+        self.inputs = model.inputs
+        self.combinational = model.combinational
+        self.interval = interval
+        self.cycles = 0
+        self.synced = True
+        self.pins = {}
+
+    def read(self, *words):
+        return self.model.read(*words)
+
+    def get(self, index=None):
+        return self.model.get(index)
+
+    def set(self, index, value):
+        self.model.set(index, value)
+        self.synced = False
+
+    def tick(self, pins):
+        self.model.tick(pins)
+        for pin, value in pins.items():
+            self.shadow.set(pin, value)
+        self.shadow.tick()
+        self.pins = pins
+
+    def tock(self):
+        self.model.tock()
+        self.shadow.tock()
+        self.cycles += 1
+        if self.synced and self.cycles % self.interval == 0:
+            self.compare([self.pins[pin] for pin in self.combinational])
+            if self.combinational:
+                self.compare([random.getrandbits(self.inputs[pin]) for pin in self.combinational])
+                for pin in self.combinational:
+                    self.shadow.set(pin, self.pins[pin])
+                self.shadow.eval()
+
+    def compare(self, words):
+        for pin, word in zip(self.combinational, words):
+            self.shadow.set(pin, word)
+        self.shadow.eval()
+        got = self.shadow.get('out') & 0xFFFF
+        expected = self.model.read(*words)
+        assert got == expected, \
+            f'{self.name} at cycle {self.cycles}, inputs {words}: gate level {got}, word level {expected}'
+
+
+# hardware cost of a chip: Nand gates, DFFs and builtin parts in total and by top-level part, and its
+# critical path, the longest chain of Nand gates between sources (inputs, DFF outputs, constants) and
+# sinks (outputs, DFF and builtin part inputs); builtin memories are taken as reads without delay
+def report(hdlfile, limit=LIMIT, wordlevel=False):
+    netlist = Netlist(hdlfile, limit, wordlevel=wordlevel)
+    chip = netlist.chips[netlist.name]
+    parts = {}
+    for kind in ('gates', 'dffs', 'parts'):
+        for owner in netlist.owners[kind]:
+            entry = parts.setdefault(chip.parts[owner][0], {'instances': 0, 'nand': 0, 'dff': 0, 'builtin': 0})
+            entry[{'gates': 'nand', 'dffs': 'dff', 'parts': 'builtin'}[kind]] += 1
+    for partname, _ in chip.parts:
+        parts.setdefault(partname, {'instances': 0, 'nand': 0, 'dff': 0, 'builtin': 0})['instances'] += 1
+    # depth of every wire and the node that sets it, in topological order
+    gates = len(netlist.gates)
+    depth = [0] * netlist.wires
+    via = [None] * netlist.wires
+    for i in netlist.order:
+        if i < gates:
+            a, b, out = netlist.gates[i]
+            source = a if depth[a] >= depth[b] else b
+            depth[out] = depth[source] + 1
+            via[out] = (i, source)
+            continue
+        model, pins = netlist.parts[i - gates]
+        sources = [wire for pin in model.combinational for wire in pins[pin]]
+        source = max(sources, key=lambda wire: depth[wire], default=None)
+        for wire in pins['out']:
+            depth[wire] = depth[source] if source is not None else 0
+            via[wire] = (None, source) if source is not None else None
+    sinks = [(f'{pin}[{bit}]' if len(wires) > 1 else pin, wire)
+             for pin, wires in netlist.outputs.items() for bit, wire in enumerate(wires)]
+    sinks += [(f'{chip.parts[owner][0]}#{owner} DFF', wire)
+              for owner, (wire, _) in zip(netlist.owners['dffs'], netlist.dffs)]
+    sinks += [(f'{type(model).__name__}.{pin}', wire) for model, pins in netlist.parts
+              for pin, wires in pins.items() if pin != 'out' for wire in wires]
+    endpoint, wire = max(sinks, key=lambda sink: depth[sink[1]], default=(None, FALSE))
+    critical = depth[wire]
+    # top-level parts along the critical path, from source to sink, as name#index in PARTS
+    path = []
+    while via[wire] is not None:
+        gate, wire = via[wire]
+        owner = netlist.owners['gates'][gate] if gate is not None else None
+        label = f'{chip.parts[owner][0]}#{owner}' if owner is not None else 'builtin read'
+        if not path or path[-1] != label:
+            path.append(label)
+    return {
+        'chip': netlist.name,
+        'nand': gates,
+        'dff': len(netlist.dffs),
+        'builtin': sorted(type(model).__name__ for model, _ in netlist.parts),
+        'wires': netlist.wires,
+        'depth': critical,
+        'endpoint': endpoint,
+        'path': path[::-1],
+        'parts': parts,
+    }
+
+
+# select b where sel is 1 and a where sel is 0, on ints and NumPy arrays alike
+def mux(a, b, sel, mask=1):
+    return (a & ((sel - 1) & mask)) | (b & (-sel & mask))
+
+
+# ALU of the Hack computer on unsigned 16-bit words
+def alu(x, y, zx, nx, zy, ny, f, no):
+    x = mux(x, 0, zx, 0xFFFF)
+    x = mux(x, ~x & 0xFFFF, nx, 0xFFFF)
+    y = mux(y, 0, zy, 0xFFFF)
+    y = mux(y, ~y & 0xFFFF, ny, 0xFFFF)
+    out = mux(x & y, (x + y) & 0xFFFF, f, 0xFFFF)
+    out = mux(out, ~out & 0xFFFF, no, 0xFFFF)
+    return {'out': out, 'zr': (out == 0) * 1, 'ng': out >> 15}
+
+
+# builtin semantics of the project chips, taking and returning unsigned pin values
+REFERENCES = {
+    'Nand': lambda p: {'out': (p['a'] & p['b']) ^ 1},
+    'Not': lambda p: {'out': p['in'] ^ 1},
+    'And': lambda p: {'out': p['a'] & p['b']},
+    'Or': lambda p: {'out': p['a'] | p['b']},
+    'Xor': lambda p: {'out': p['a'] ^ p['b']},
+    'Mux': lambda p: {'out': mux(p['a'], p['b'], p['sel'])},
+    'DMux': lambda p: {'a': p['in'] & (p['sel'] ^ 1), 'b': p['in'] & p['sel']},
+    'Not16': lambda p: {'out': ~p['in'] & 0xFFFF},
+    'And16': lambda p: {'out': p['a'] & p['b']},
+    'Or16': lambda p: {'out': p['a'] | p['b']},
+    'Mux16': lambda p: {'out': mux(p['a'], p['b'], p['sel'], 0xFFFF)},
+    'Or8Way': lambda p: {'out': (p['in'] != 0) * 1},
+    'Mux4Way16': lambda p: {'out': mux(mux(p['a'], p['b'], p['sel'] & 1, 0xFFFF),
+                                       mux(p['c'], p['d'], p['sel'] & 1, 0xFFFF), p['sel'] >> 1, 0xFFFF)},
+    'Mux8Way16': lambda p: {'out': mux(REFERENCES['Mux4Way16']({**p, 'sel': p['sel'] & 3})['out'],
+                                       REFERENCES['Mux4Way16']({'a': p['e'], 'b': p['f'], 'c': p['g'],
+                                                                'd': p['h'], 'sel': p['sel'] & 3})['out'],
+                                       p['sel'] >> 2, 0xFFFF)},
+    'DMux4Way': lambda p: {pin: p['in'] * (p['sel'] == i) for i, pin in enumerate('abcd')},
+    'DMux8Way': lambda p: {pin: p['in'] * (p['sel'] == i) for i, pin in enumerate('abcdefgh')},
+    'HalfAdder': lambda p: {'sum': p['a'] ^ p['b'], 'carry': p['a'] & p['b']},
+    'FullAdder': lambda p: {'sum': (p['a'] + p['b'] + p['c']) & 1, 'carry': (p['a'] + p['b'] + p['c']) >> 1},
+    'Add16': lambda p: {'out': (p['a'] + p['b']) & 0xFFFF},
+    'Inc16': lambda p: {'out': (p['in'] + 1) & 0xFFFF},
+    'ALU': lambda p: alu(p['x'], p['y'], p['zx'], p['nx'], p['zy'], p['ny'], p['f'], p['no']),
+}
+
+
+# packed lanes where lane i holds bit j of i, for every j below count
+def patterns(count):
+    lanes = 1 << count
+    everything = (1 << lanes) - 1
+    return [((1 << (1 << j)) - 1 << (1 << j)) * (everything // ((1 << (2 << j)) - 1)) for j in range(count)]
+
+
+# each byte of packed lanes spread to 8 little-endian 16-bit slots of 0/1
+SPREAD = [b''.join(bytes(((i >> bit) & 1, 0)) for bit in range(8)) for i in range(256)]
+
+
+# per-lane unsigned words of a bus, up to 16 bits, from its packed wires
+def unpack(packed, lanes, vectorized=False):
+    if vectorized:
+        # constant wires are scalars, broadcast to all lanes
+        packed = [np.full(lanes // 64, wire, dtype=np.uint64) for wire in packed]
+        bits = [np.unpackbits(wire.view(np.uint8), bitorder='little').astype(np.int64) for wire in packed]
+        return sum(bit << i for i, bit in enumerate(bits))
+    # every lane becomes a 16-bit slot of one big int, and the bit planes are added in place
+    size = max(1, lanes // 8)
+    words = 0
+    for i, wire in enumerate(packed):
+        spread = b''.join(SPREAD[b] for b in wire.to_bytes(size, 'little'))
+        words |= int.from_bytes(spread, 'little') << i
+    return array('H', words.to_bytes(16 * size, 'little'))[:lanes].tolist()
+
+
+# check a combinational chip over every input combination, or over random samples when it has more
+# than bits input bits, against another netlist or the builtin semantics of the chip,
+# returns (vectors, whether every combination was checked, mismatches, first counterexample)
+def verify(netlist, against=None, bits=24, samples=1 << CHUNK):
+    assert not netlist.dffs and not netlist.parts, f'{netlist.name} is not combinational'
+    reference = REFERENCES.get(netlist.name) if against is None else None
+    assert against is not None or reference is not None, f'no reference model of {netlist.name}'
+    if against is not None:
+        pins = [(pin, len(wires)) for pin, wires in {**netlist.inputs, **netlist.outputs}.items()]
+        assert pins == [(pin, len(({**against.inputs, **against.outputs}).get(pin, ()))) for pin, _ in pins], \
+            f'pins of {against.name} differ from {netlist.name}'
+    simulators = [Simulator(netlist)] + ([Simulator(against)] if against is not None else [])
+    wires = [wire for pin in netlist.inputs for wire in netlist.inputs[pin]]
+    exhaustive = len(wires) <= bits
+    count = min(len(wires), CHUNK) if exhaustive else CHUNK
+    lanes = 1 << count
+    chunks = 1 << (len(wires) - count) if exhaustive else max(1, samples >> CHUNK)
+    low = patterns(count)
+    # NumPy lanes need whole 64-bit words
+    vectorized = np is not None and lanes >= 64
+    mask = np.uint64(0xFFFFFFFFFFFFFFFF) if vectorized else (1 << lanes) - 1
+    mismatches = 0
+    counterexample = None
+    for chunk in range(chunks):
+        if exhaustive:
+            packed = low + [(1 << lanes) - 1 if chunk >> j & 1 else 0 for j in range(len(wires) - count)]
+        else:
+            packed = [random.getrandbits(lanes) for _ in wires]
+        if vectorized:
+            packed = [np.frombuffer(value.to_bytes(lanes // 8, 'little'), dtype=np.uint64) for value in packed]
+        results = []
+        for simulator in simulators:
+            pins = simulator.netlist.inputs
+            for wire, value in zip([wire for pin in netlist.inputs for wire in pins[pin]], packed):
+                simulator.values[wire] = value
+            simulator.evaluate(simulator.values, mask, [])
+            results.append({pin: unpack([simulator.values[wire] for wire in wires], lanes, vectorized)
+                            for pin, wires in simulator.netlist.outputs.items()})
+        inputs = {}
+        offset = 0
+        for pin, pinwires in netlist.inputs.items():
+            inputs[pin] = unpack(packed[offset:offset + len(pinwires)], lanes, vectorized)
+            offset += len(pinwires)
+        if against is not None:
+            expected = results[1]
+        elif vectorized:
+            expected = reference(inputs)
+        else:
+            rows = [reference({pin: inputs[pin][lane] for pin in inputs}) for lane in range(lanes)]
+            expected = {pin: [row[pin] for row in rows] for pin in netlist.outputs}
+        got = results[0]
+        if vectorized:
+            wrong = np.zeros(lanes, dtype=bool)
+            for pin in netlist.outputs:
+                wrong |= got[pin] != expected[pin]
+            failures = np.flatnonzero(wrong).tolist()
+        else:
+            failures = [lane for lane in range(lanes) if any(got[pin][lane] != expected[pin][lane] for pin in got)]
+        mismatches += len(failures)
+        if failures and counterexample is None:
+            lane = failures[0]
+            counterexample = ({pin: int(inputs[pin][lane]) for pin in inputs},
+                              {pin: int(got[pin][lane]) for pin in got},
+                              {pin: int(expected[pin][lane]) for pin in got})
+    return chunks * lanes, exhaustive, mismatches, counterexample
+
+
+if __name__ == '__main__':
+    # parse commandline
+    parser = argparse.ArgumentParser(description='simulator of HDL chips flattened to Nand gates')
+    parser.add_argument('input', nargs='+', help='.hdl files of chips')
+    parser.add_argument('-s', '--set', action='append', default=[], metavar='PIN=VALUE',
+                        help='input pin value, could be repeated')
+    parser.add_argument('--limit', type=int, default=LIMIT, help='maximum Nand gates of the flattened chip')
+    parser.add_argument('--cache', default=os.path.join(os.path.expanduser('~'), '.cache', 'hack-hdl'),
+                        help='folder of compiled netlists, keyed by the content of every source file')
+    parser.add_argument('--no-cache', action='store_true', help='flatten chips without the cache')
+    parser.add_argument('--gates', action='store_true', help='flatten Register, PC and RAM parts to gates too')
+    parser.add_argument('--words', action='store_true', help='always use word-level Register, PC and RAM parts')
+    parser.add_argument('--report', action='store_true',
+                        help='print Nand count, per-part breakdown and critical path depth as JSON')
+    parser.add_argument('--verify', action='store_true',
+                        help='check every input combination against the builtin semantics of the chip')
+    parser.add_argument('--against', help='.hdl file of a reference design to verify against')
+    parser.add_argument('--bits', type=int, default=24, help='maximum input bits verified exhaustively')
+    parser.add_argument('--samples', type=int, default=1 << CHUNK, help='random vectors of wider chips')
+    args = parser.parse_args()
+    cachedir = None if args.no_cache else args.cache
+    wordlevel = False if args.gates else True if args.words else None
+    if args.report:
+        try:
+            reports = [report(inputfile, args.limit, wordlevel) for inputfile in args.input]
+        except NetlistTooLarge as e:
+            print(f'error: {e}, raise --limit or drop --gates', file=sys.stderr)
+            exit(1)
+        print(json.dumps(reports[0] if len(reports) == 1 else reports, indent=2))
+        exit(0)
+    failed = False
+    for inputfile in args.input:
+        netlist = Netlist(inputfile, args.limit, cachedir, wordlevel)
+        print(f'{netlist.name}: {len(netlist.gates)} Nand, {len(netlist.dffs)} DFF, '
+              f'{len(netlist.parts)} builtin parts, {netlist.wires} wires')
+        if args.verify or args.against:
+            start = time.perf_counter()
+            against = Netlist(args.against, args.limit, cachedir, wordlevel) if args.against else None
+            vectors, exhaustive, mismatches, counterexample = verify(netlist, against, args.bits, args.samples)
+            mode = 'exhaustive' if exhaustive else 'random'
+            print(f'  {vectors} {mode} vectors, {mismatches} mismatches in {time.perf_counter() - start:.3f}s')
+            if counterexample:
+                failed = True
+                inputs, got, expected = counterexample
+                print(f'  inputs {inputs}\n  got {got}\n  expected {expected}')
+            continue
+        vector = {}
+        for assignment in args.set:
+            pin, value = assignment.split('=')
+            vector[pin] = int(value, 0)
+        for pin, value in Simulator(netlist).run([vector])[0].items():
+            print(f'  {pin} = {value}')
+    exit(1 if failed else 0)
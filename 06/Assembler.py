@@ -1,57 +1,69 @@
 #!/opt/homebrew/bin/python3
 
+import argparse
+import bisect
+import hashlib
+import json
+import mmap
+import os
+import shutil
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from array import array
+from collections import namedtuple
 
 
 class Code:
 
-    def __init__(self) -> None:
-        # initialize translate dictionary, mind that the code is read from right to left, AKA big endian
-        self.dest_dict = {
-            'M': 2,
-            'D': 1,
-            'A': 0,
-        }
-        self.comp_dict = {
-            '0': '0101010',
-            '1': '0111111',
-            '-1': '0111010',
-            'D': '0001100',
-            'A': '0110000',
-            'M': '1110000',
-            '!D': '0001101',
-            '!A': '0110001',
-            '!M': '1110001',
-            '-D': '0001111',
-            '-A': '0110011',
-            '-M': '1110011',
-            'D+1': '0011111',
-            'A+1': '0110111',
-            'M+1': '1110111',
-            'D-1': '0001110',
-            'A-1': '0110010',
-            'M-1': '1110010',
-            'D+A': '0000010',
-            'D+M': '1000010',
-            'D-A': '0010011',
-            'D-M': '1010011',
-            'A-D': '0000111',
-            'M-D': '1000111',
-            'D&A': '0000000',
-            'D&M': '1000000',
-            'D|A': '0010101',
-            'D|M': '1010101',
-        }
-        self.jump_dict = {
-            'null': '000',
-            'JGT': '001',
-            'JEQ': '010',
-            'JGE': '011',
-            'JLT': '100',
-            'JNE': '101',
-            'JLE': '110',
-            'JMP': '111',
-        }
+    # translate dictionary shared by all instances, built once instead of per instruction
+    # mind that the code is read from right to left, AKA big endian
+    dest_dict = {
+        'M': 0b001,
+        'D': 0b010,
+        'A': 0b100,
+    }
+    comp_dict = {
+        '0': 0b0101010,
+        '1': 0b0111111,
+        '-1': 0b0111010,
+        'D': 0b0001100,
+        'A': 0b0110000,
+        'M': 0b1110000,
+        '!D': 0b0001101,
+        '!A': 0b0110001,
+        '!M': 0b1110001,
+        '-D': 0b0001111,
+        '-A': 0b0110011,
+        '-M': 0b1110011,
+        'D+1': 0b0011111,
+        'A+1': 0b0110111,
+        'M+1': 0b1110111,
+        'D-1': 0b0001110,
+        'A-1': 0b0110010,
+        'M-1': 0b1110010,
+        'D+A': 0b0000010,
+        'D+M': 0b1000010,
+        'D-A': 0b0010011,
+        'D-M': 0b1010011,
+        'A-D': 0b0000111,
+        'M-D': 0b1000111,
+        'D&A': 0b0000000,
+        'D&M': 0b1000000,
+        'D|A': 0b0010101,
+        'D|M': 0b1010101,
+    }
+    jump_dict = {
+        'null': 0b000,
+        'JGT': 0b001,
+        'JEQ': 0b010,
+        'JGE': 0b011,
+        'JLT': 0b100,
+        'JNE': 0b101,
+        'JLE': 0b110,
+        'JMP': 0b111,
+    }
+    # memoized 16-bit word of each raw C_INSTRUCTION text
+    cache = {}
 
     # convert comp field to binary code
     def comp(self, symbol):
@@ -59,42 +71,57 @@ class Code:
 
     # convert dest field to binary code
     def dest(self, symbol):
-        code = ['0', '0', '0']
+        code = 0
         if symbol == 'null':
-            return ''.join(code)
-        for d, i in self.dest_dict.items():
+            return code
+        for d, bit in self.dest_dict.items():
             if d in symbol:
-                code[i] = '1'
-        return ''.join(code)
+                code |= bit
+        return code
 
     # convert jump field to binary code
     def jump(self, symbol):
         return self.jump_dict[symbol]
 
+    # convert whole C_INSTRUCTION to 16-bit word, repeated instruction costs one dict lookup
+    def encode(self, instruction):
+        word = self.cache.get(instruction)
+        if word is None:
+            word = 0b111 << 13 | self.comp(Parser.comp(instruction)) << 6 | self.dest(
+                Parser.dest(instruction)) << 3 | self.jump(Parser.jump(instruction))
+            self.cache[instruction] = word
+        return word
+
+
+# pre-parsed instruction record, text is the symbol of A/L_INSTRUCTION or the raw C_INSTRUCTION
+Instruction = namedtuple('Instruction', ['type', 'text'])
+
 
 class Parser:
 
-    def __init__(self, inputfile) -> None:
-        self.file = open(inputfile, 'r')
+    def __init__(self, lines, verbose=False) -> None:
+        self.lines = iter(lines)
+        self.verbose = verbose
         self.curr_line = ''
         self.curr_instruction = ''
         self.curr_instructionType = ''
 
-    # check if new line exists in file stream and get it
+    # check if new line exists in line stream and get it
     def hasMoreLines(self):
-        # get new line from file stream
-        self.curr_line = self.file.readline()
-        return True if self.curr_line else False
+        # get new line from line stream
+        self.curr_line = next(self.lines, None)
+        return self.curr_line is not None
 
     # trim useless blank space and comment
     def advance(self):
         # trim newline, space and tab
         self.curr_instruction = self.curr_line.strip()
-        # trim inline comment
+        # trim inline comment and the blank space before it
         dash = self.curr_instruction.find('//')
-        self.curr_instruction = self.curr_instruction[:
-                                                      dash] if dash > 0 else self.curr_instruction
-        print(self.curr_instruction)
+        self.curr_instruction = self.curr_instruction[:dash].rstrip(
+        ) if dash > 0 else self.curr_instruction
+        if self.verbose:
+            print(self.curr_instruction)
 
     # get the instruction's type
     def instructionType(self):
@@ -117,7 +144,8 @@ class Parser:
         # other cases
         else:
             self.curr_instructionType = ''
-        print('type:', self.curr_instructionType)
+        if self.verbose:
+            print('type:', self.curr_instructionType)
 
     # get symbol in instruction
     def symbol(self):
@@ -131,33 +159,176 @@ class Parser:
         else:
             pass
 
-    # distract comp fields from current instruction
-    def comp(self):
-        equal = self.curr_instruction.find('=')
-        column = self.curr_instruction.find(';')
-        return self.curr_instruction[
-            equal + 1:] if column == -1 else self.curr_instruction[equal +
-                                                                   1:column]
-
-    # distract dest fields from current instruction
-    def dest(self):
-        if '=' not in self.curr_instruction:
+    # read the whole line stream once into a list of instruction records
+    def parse(self):
+        instructions = []
+        while self.hasMoreLines():
+            self.advance()
+            self.instructionType()
+            if self.curr_instructionType in ('A_INSTRUCTION', 'L_INSTRUCTION'):
+                instructions.append(
+                    Instruction(self.curr_instructionType, self.symbol()))
+            elif self.curr_instructionType == 'C_INSTRUCTION':
+                # blank space inside fields, e.g. M = 0, is allowed
+                instructions.append(
+                    Instruction(self.curr_instructionType, ''.join(self.curr_instruction.split())))
+            # skip comment and blank
+            else:
+                assert self.curr_instructionType, 'not valid instruction: ' + self.curr_line
+        return instructions
+
+    # distract comp fields from C_INSTRUCTION
+    @staticmethod
+    def comp(instruction):
+        equal = instruction.find('=')
+        column = instruction.find(';')
+        return instruction[equal + 1:] if column == -1 else instruction[equal + 1:column]
+
+    # distract dest fields from C_INSTRUCTION
+    @staticmethod
+    def dest(instruction):
+        if '=' not in instruction:
             return 'null'
-        return self.curr_instruction[:self.curr_instruction.find('=')]
+        return instruction[:instruction.find('=')]
 
-    # distract jump fields from current instruction
-    def jump(self):
-        if ';' not in self.curr_instruction:
+    # distract jump fields from C_INSTRUCTION
+    @staticmethod
+    def jump(instruction):
+        if ';' not in instruction:
             return 'null'
-        return self.curr_instruction[self.curr_instruction.find(';') + 1:]
+        return instruction[instruction.find(';') + 1:]
+
+
+# rewrite redundant instruction sequences of parsed program before symbols are bound
+class Optimizer:
+
+    # (name, pattern, replacement), @{X} binds any symbol and @{a} binds a number, a callable
+    # replacement returns None to decline, every rule leaves A, D and memory as the original sequence does
+    rules = [
+        # push directly followed by pop keeps SP, only A needs to point at the top
+        ('push-pop', ['@SP', 'M=M+1', '@SP', 'AM=M-1'], ['@SP', 'A=M']),
+        # reload address just stored through, e.g. @SP / A=M / M=D / @SP / A=M
+        ('store-reload-address', ['@{X}', 'A=M', 'M=D', '@{X}', 'A=M'], ['@{X}', 'A=M', 'M=D']),
+        # value just stored is still in D
+        ('store-reload-D', ['M=D', 'D=M'], ['M=D']),
+        ('store-reload-A', ['M=D', 'A=M'], ['M=D', 'A=D']),
+        # consecutive constant subtraction, e.g. ARG = SP - 5 - nArgs, A is rewritten by the next @;
+        # the sum must still fit an A-instruction
+        ('fold-sub', ['@{a}', 'D=D-A', '@{b}', 'D=D-A', '@{X}'],
+         lambda b: ['@' + str(int(b['a']) + int(b['b'])), 'D=D-A', '@' + b['X']]
+         if int(b['a']) + int(b['b']) <= 32767 else None),
+    ]
+
+    def __init__(self, instructions, verbose=False) -> None:
+        self.instructions = instructions
+        self.verbose = verbose
+        self.hits = {rule[0]: 0 for rule in self.rules}
+        self.hits['redundant-A'] = 0
+
+    # optimize each basic block independently, labels and jumps end a block
+    def optimize(self):
+        optimized = []
+        block = []
+        for instruction in self.instructions:
+            if instruction.type == 'L_INSTRUCTION':
+                optimized += self.optimizeBlock(block)
+                optimized.append(instruction)
+                block = []
+            elif instruction.type == 'C_INSTRUCTION' and ';' in instruction.text:
+                block.append(instruction)
+                optimized += self.optimizeBlock(block)
+                block = []
+            else:
+                block.append(instruction)
+        optimized += self.optimizeBlock(block)
+        if self.verbose:
+            for name, hit in self.hits.items():
+                print(f'{name}: {hit}')
+        self.saved = len(self.instructions) - len(optimized)
+        return optimized
+
+    # apply rules until none matches, stepping back so that a rewrite can enable another one
+    def optimizeBlock(self, block):
+        codes = [self.source(instruction) for instruction in block]
+        i = 0
+        while i < len(codes):
+            replaced = self.rewrite(codes, i)
+            i = max(i - 4, 0) if replaced else i + 1
+        return [self.record(code) for code in codes]
+
+    # try each rule at position i of codes, rewrite codes in place
+    def rewrite(self, codes, i):
+        for name, pattern, replacement in self.rules:
+            bindings = self.match(pattern, codes[i:i + len(pattern)])
+            if bindings is None:
+                continue
+            if callable(replacement):
+                replaced = replacement(bindings)
+                if replaced is None:
+                    continue
+            else:
+                replaced = [code.format(**bindings) for code in replacement]
+            codes[i:i + len(pattern)] = replaced
+            self.hits[name] += 1
+            return True
+        # @X / instruction not writing A / @X, the second @X reloads the same address
+        if i + 2 < len(codes) and codes[i].startswith('@') and codes[i] == codes[i + 2] \
+                and not codes[i + 1].startswith('@') and 'A' not in Parser.dest(codes[i + 1]) \
+                and ';' not in codes[i + 1]:
+            del codes[i + 2]
+            self.hits['redundant-A'] += 1
+            return True
+        return False
+
+    # match codes against pattern, returns bindings of placeholders or None
+    def match(self, pattern, codes):
+        if len(codes) != len(pattern):
+            return None
+        bindings = {}
+        for token, code in zip(pattern, codes):
+            if '{' not in token:
+                if token != code:
+                    return None
+                continue
+            name = token[2:-1]
+            if not code.startswith('@'):
+                return None
+            value = code[1:]
+            # lower case placeholder only binds number
+            if name.islower() and not value.isdigit():
+                return None
+            if bindings.setdefault(name, value) != value:
+                return None
+        return bindings
+
+    # convert between instruction record and its source form
+    @staticmethod
+    def source(instruction):
+        return '@' + instruction.text if instruction.type == 'A_INSTRUCTION' else instruction.text
+
+    @staticmethod
+    def record(code):
+        if code.startswith('@'):
+            return Instruction('A_INSTRUCTION', code[1:])
+        return Instruction('C_INSTRUCTION', code)
 
 
 class Assembler:
 
-    def __init__(self, inputfile) -> None:
-        # file operation
+    def __init__(self, inputfile=None, verbose=False, binary=False, relocatable=False,
+                 optimize=False) -> None:
+        # file operation, derive output names from the extension only, in-memory use needs no file
         self.inputfile = inputfile
-        self.outputfile = self.inputfile.replace('asm', 'hack')
+        if self.inputfile:
+            basename = os.path.splitext(self.inputfile)[0]
+            self.outputfile = basename + '.hack'
+            self.symbolfile = basename + '.sym'
+            self.romfile = basename + '.rom'
+            self.objectfile = basename + '.hobj'
+        self.verbose = verbose
+        self.binary = binary
+        self.relocatable = relocatable
+        self.optimize = optimize
         # initial symbol table with predefined symbol
         self.symbol_table = {
             'R0': 0,
@@ -184,82 +355,129 @@ class Assembler:
             'SCREEN': 16384,
             'KBD': 24576,
         }
+        # user defined symbols, kept apart for the symbol file
+        self.labels = {}
+        self.variables = {}
         # address track
         self.rom_addr = 0
         self.ram_addr = 16
 
     # assemble .asm to .hack
     def assemble(self):
-        self.file = open(self.outputfile, 'w')
+        # read and parse the source only once, later passes walk the in-memory records
+        with open(self.inputfile, 'r') as f:
+            self.load(f.read())
+        if self.optimize:
+            print('words saved by optimizer: ', self.saved)
+        if self.relocatable:
+            self.assembleObject()
+            return
         self.first_pass()
-        self.second_pass()
-        self.file.close()
+        writeSymbols(self.labels, self.variables, self.symbolfile)
+        self.words = words = self.second_pass()
+        writeHack(words, self.outputfile)
         print('binary code saved to: ', self.outputfile)
+        if self.binary:
+            writeROM(words, self.romfile)
+            print('ROM image saved to: ', self.romfile)
+
+    # assemble .asm to relocatable .hobj, left for Linker to place and resolve
+    def assembleObject(self):
+        self.L_pass()
+        with open(self.objectfile, 'w') as f:
+            json.dump(self.relocate(), f)
+        print('object code saved to: ', self.objectfile)
+
+    # parse assembly text or iterable of lines into instruction records
+    def load(self, source):
+        lines = source.splitlines() if isinstance(source, str) else source
+        self.instructions = Parser(lines, self.verbose).parse()
+        # peephole rewrite happens before labels are bound, so they pick up the shrunk addresses
+        if self.optimize:
+            optimizer = Optimizer(self.instructions, self.verbose)
+            self.instructions = optimizer.optimize()
+            self.saved = optimizer.saved
 
     # parse L_INSTRUCTION symbol
     def L_pass(self):
-        P = Parser(self.inputfile)
-        while P.hasMoreLines():
-            P.advance()
-            P.instructionType()
-            symbol = P.symbol()
-            if P.curr_instructionType == 'L_INSTRUCTION':
+        for instruction in self.instructions:
+            if instruction.type == 'L_INSTRUCTION':
                 # bind label symbol to next rom address
-                self.addEntry(symbol, self.rom_addr)
-            elif P.curr_instructionType == 'A_INSTRUCTION' or P.curr_instructionType == 'C_INSTRUCTION':
+                self.addEntry(instruction.text, self.rom_addr)
+                self.labels[instruction.text] = self.rom_addr
+            else:
                 self.rom_addr += 1
 
     # parse A_INSTRUCTION symbol
     def A_pass(self):
-        P = Parser(self.inputfile)
-        while P.hasMoreLines():
-            P.advance()
-            P.instructionType()
-            symbol = P.symbol()
-            if P.curr_instructionType == 'A_INSTRUCTION':
+        for instruction in self.instructions:
+            if instruction.type == 'A_INSTRUCTION':
+                symbol = instruction.text
                 # bind variable symbol to next ram address for first appearence
                 if not symbol.isdigit() and not self.contains(symbol):
                     self.addEntry(symbol, self.ram_addr)
+                    self.variables[symbol] = self.ram_addr
                     self.ram_addr += 1
 
     # first pass of assemble, aim to construct symbol table
     def first_pass(self):
         self.L_pass()
         self.A_pass()
-        # dump symbol table
-        self.symbolfile = self.inputfile.replace('asm', 'sym')
-        with open(self.symbolfile, 'w') as f:
-            for i in self.symbol_table.items():
-                f.write(str(i) + '\n')
 
-    # second pass of assemble, aim to parse each line
+    # second pass of assemble, aim to encode each instruction to 16-bit word
     def second_pass(self):
-        P = Parser(self.inputfile)
-        while P.hasMoreLines():
-            P.advance()
-            P.instructionType()
-            if P.curr_instructionType == 'A_INSTRUCTION':
-                symbol = P.symbol()
+        return array('H', self.encode())
+
+    # yield 16-bit word of each instruction as soon as it is encoded
+    def encode(self):
+        C = Code()
+        for instruction in self.instructions:
+            if instruction.type == 'A_INSTRUCTION':
+                symbol = instruction.text
                 # get symbol address
                 if not symbol.isdigit():
                     number = self.getAddress(symbol)
                 else:
                     number = int(symbol)
-                # convert to binary format
-                code = bin(number)[2:].rjust(16, '0') + '\n'
-                self.file.write(code)
-            elif P.curr_instructionType == 'C_INSTRUCTION':
-                # construct code by fields
-                code = '111'
-                C = Code()
-                code += C.comp(P.comp())
-                code += C.dest(P.dest())
-                code += C.jump(P.jump())
-                code += '\n'
-                self.file.write(code)
-            # skip L_INSTRUCTION, comment and blank for second pass
-            else:
-                assert P.curr_instructionType, 'not valid instruction type'
+                yield number
+            elif instruction.type == 'C_INSTRUCTION':
+                yield C.encode(instruction.text)
+            # skip L_INSTRUCTION for second pass
+
+    # alternative second pass, labels are relative to address 0 and other symbols are imported
+    def relocate(self):
+        labels = [instruction.text for instruction in self.instructions
+                  if instruction.type == 'L_INSTRUCTION']
+        local = set(labels)
+        words = []
+        # offsets of words holding a label address, which Linker shifts by the object's base
+        relocations = []
+        # offsets of words referring to each undefined symbol, in order of first appearance
+        imports = {}
+        C = Code()
+        for instruction in self.instructions:
+            if instruction.type == 'A_INSTRUCTION':
+                symbol = instruction.text
+                if symbol.isdigit():
+                    words.append(int(symbol))
+                elif symbol in local:
+                    relocations.append(len(words))
+                    words.append(self.getAddress(symbol))
+                # predefined symbol
+                elif self.contains(symbol):
+                    words.append(self.getAddress(symbol))
+                # label of other object or variable, decided by Linker
+                else:
+                    imports.setdefault(symbol, []).append(len(words))
+                    words.append(0)
+            elif instruction.type == 'C_INSTRUCTION':
+                words.append(C.encode(instruction.text))
+        return {
+            'code': words,
+            'relocations': relocations,
+            'exports': {label: self.getAddress(label) for label in labels},
+            'imports': imports,
+        }
 
     def addEntry(self, symbol, address):
         self.symbol_table.update({symbol: address})
@@ -271,8 +489,230 @@ class Assembler:
         return self.symbol_table[symbol]
 
 
+# assemble many .asm files over a process pool, skipping sources already seen by the cache
+class Batch:
+
+    def __init__(self, inputs, jobs=None, cachedir=None, cachesize=1024, verbose=False, binary=False,
+                 relocatable=False, optimize=False) -> None:
+        # collect .asm files, folders are searched recursively
+        self.inputfiles = []
+        for input in inputs:
+            if os.path.isdir(input):
+                for root, _, files in os.walk(input):
+                    self.inputfiles += sorted(
+                        os.path.join(root, file) for file in files if file.endswith('.asm'))
+            else:
+                self.inputfiles.append(input)
+        self.jobs = jobs
+        self.cachedir = cachedir
+        self.cachesize = cachesize
+        self.verbose = verbose
+        self.binary = binary
+        self.relocatable = relocatable
+        self.optimize = optimize
+        # the assembler itself and its options are part of the key, so cached outputs expire when they change
+        with open(__file__, 'rb') as f:
+            self.version = hashlib.sha256(f.read()).digest() + bytes([relocatable, optimize])
+
+    # assemble every input file, returns the number of cache hits
+    def run(self):
+        hits = 0
+        misses = []
+        for inputfile in self.inputfiles:
+            entry = self.lookup(inputfile) if self.cachedir else None
+            if entry:
+                self.restore(entry, inputfile)
+                hits += 1
+            else:
+                misses.append(inputfile)
+        # unchanged tree never pays for starting the pool
+        if misses:
+            with ProcessPoolExecutor(self.jobs) as executor:
+                list(executor.map(self.assembleFile, misses))
+        if self.cachedir:
+            self.evict()
+        print(f'{len(self.inputfiles)} files assembled, {hits} from cache')
+        return hits
+
+    # content hash of source file, used as name of cache entry
+    def key(self, inputfile):
+        with open(inputfile, 'rb') as f:
+            return hashlib.sha256(self.version + f.read()).hexdigest()
+
+    # get cache entry of source file and mark it as recently used
+    def lookup(self, inputfile):
+        entry = os.path.join(self.cachedir, self.key(inputfile))
+        if not os.path.isdir(entry):
+            return None
+        os.utime(entry)
+        return entry
+
+    # copy cached outputs next to source file
+    def restore(self, entry, inputfile):
+        basename = os.path.splitext(inputfile)[0]
+        if self.relocatable:
+            extensions = ['.hobj']
+        else:
+            extensions = ['.hack', '.sym', '.rom'] if self.binary else ['.hack', '.sym']
+        for extension in extensions:
+            shutil.copyfile(os.path.join(entry, 'out' + extension), basename + extension)
+        if self.verbose:
+            print('restored from cache: ', inputfile)
+
+    # assemble one file in worker process and store its outputs in cache
+    def assembleFile(self, inputfile):
+        A = Assembler(inputfile, self.verbose, self.binary,
+                      self.relocatable, self.optimize)
+        A.assemble()
+        if not self.cachedir:
+            return None
+        entry = os.path.join(self.cachedir, self.key(inputfile))
+        # build entry aside and rename it into place, so readers never see a partial entry
+        tmp = f'{entry}.{os.getpid()}.tmp'
+        os.makedirs(tmp, exist_ok=True)
+        if self.relocatable:
+            shutil.copyfile(A.objectfile, os.path.join(tmp, 'out.hobj'))
+        else:
+            shutil.copyfile(A.outputfile, os.path.join(tmp, 'out.hack'))
+            shutil.copyfile(A.symbolfile, os.path.join(tmp, 'out.sym'))
+            writeROM(A.words, os.path.join(tmp, 'out.rom'))
+        try:
+            os.rename(tmp, entry)
+        # same source assembled by another worker
+        except OSError:
+            shutil.rmtree(tmp)
+        return entry
+
+    # drop least recently used entries beyond cache size
+    def evict(self):
+        entries = [os.path.join(self.cachedir, name) for name in os.listdir(self.cachedir)
+                   if not name.endswith('.tmp')]
+        entries.sort(key=os.path.getmtime)
+        for entry in entries[:max(len(entries) - self.cachesize, 0)]:
+            shutil.rmtree(entry)
+
+
+# assemble text or iterable of lines in memory, returns words and symbol table,
+# with generator=True the words are yielded one by one instead
+def assemble(source, generator=False, verbose=False, optimize=False):
+    A = Assembler(verbose=verbose, optimize=optimize)
+    A.load(source)
+    A.first_pass()
+    if generator:
+        return A.encode(), A.symbol_table
+    return A.second_pass(), A.symbol_table
+
+
+# write words as textual .hack, one 16-bit binary string per line
+def writeHack(words, outputfile):
+    with open(outputfile, 'w') as f:
+        f.writelines(format(word, '016b') + '\n' for word in words)
+
+
+# dump user defined symbols, ROM labels and RAM variables in separate sections sorted by address,
+# one "address symbol" pair per line
+def writeSymbols(labels, variables, symbolfile):
+    with open(symbolfile, 'w') as f:
+        for section, symbols in (('[labels]', labels), ('[variables]', variables)):
+            f.write(section + '\n')
+            for symbol, address in sorted(symbols.items(), key=lambda i: i[1]):
+                f.write(f'{address} {symbol}\n')
+
+
+# load symbol file written by writeSymbols, for profilers and debuggers mapping addresses back to names
+class SymbolFile:
+
+    def __init__(self, symbolfile) -> None:
+        self.labels = {}
+        self.variables = {}
+        with open(symbolfile, 'r') as f:
+            symbols = None
+            for line in f:
+                line = line.strip()
+                if line == '[labels]':
+                    symbols = self.labels
+                elif line == '[variables]':
+                    symbols = self.variables
+                elif line:
+                    address, symbol = line.split(' ', 1)
+                    symbols[symbol] = int(address)
+        # name to address, predefined symbols included
+        self.symbol_table = dict(Assembler().symbol_table)
+        self.symbol_table.update(self.variables)
+        self.symbol_table.update(self.labels)
+        # label addresses in ascending order, for bisection
+        ordered = sorted(self.labels.items(), key=lambda i: i[1])
+        self.label_names = [symbol for symbol, _ in ordered]
+        self.label_addrs = [address for _, address in ordered]
+
+    # address of symbol in O(1)
+    def getAddress(self, symbol):
+        return self.symbol_table[symbol]
+
+    # nearest label at or before ROM address in O(log n), None if address precedes every label
+    def label(self, address):
+        i = bisect.bisect_right(self.label_addrs, address) - 1
+        return self.label_names[i] if i >= 0 else None
+
+
+# write words as packed little-endian uint16 ROM image in one bulk write
+def writeROM(words, romfile):
+    image = array('H', words)
+    if sys.byteorder == 'big':
+        image.byteswap()
+    with open(romfile, 'wb') as f:
+        f.write(image.tobytes())
+
+
+# memory-map packed ROM image, returns a read-only sequence of 16-bit words
+def loadROM(romfile):
+    with open(romfile, 'rb') as f:
+        # empty file can not be mapped
+        if not f.seek(0, 2):
+            return array('H')
+        image = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    # the mapping is native-ordered, fall back to a swapped copy on big endian host
+    if sys.byteorder == 'big':
+        words = array('H')
+        words.frombytes(image)
+        words.byteswap()
+        return words
+    return memoryview(image).cast('H')
+
+
 if __name__ == '__main__':
-    assert sys.argv[1].endswith(
-        '.asm'), 'input filename must contain .asm extension'
-    A = Assembler(sys.argv[1])
-    A.assemble()
+    # parse commandline
+    parser = argparse.ArgumentParser(
+        description='Hack assembler, from HACK assembly code to binary code')
+    parser.add_argument('input', nargs='+',
+                        help='.asm file, several files or folders switch to batch mode')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='trace each parsed instruction to console')
+    parser.add_argument('-b', '--binary', action='store_true',
+                        help='also write packed little-endian .rom image')
+    parser.add_argument('-c', '--relocatable', action='store_true',
+                        help='write relocatable .hobj object for Linker instead of .hack')
+    parser.add_argument('-O', '--optimize', action='store_true',
+                        help='apply peephole rules before binding labels, jumps must target labels')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='worker processes of batch mode, default to cpu count')
+    parser.add_argument('--cache', default=os.path.join(os.path.expanduser('~'), '.cache', 'hack-assembler'),
+                        help='output cache folder of batch mode')
+    parser.add_argument('--cache-size', type=int, default=1024,
+                        help='max number of cached outputs, least recently used ones are evicted')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='always assemble in batch mode')
+    args = parser.parse_args()
+    if len(args.input) == 1 and not os.path.isdir(args.input[0]):
+        assert args.input[0].endswith(
+            '.asm'), 'input filename must contain .asm extension'
+        A = Assembler(args.input[0], args.verbose,
+                      args.binary, args.relocatable, args.optimize)
+        A.assemble()
+    else:
+        cachedir = None if args.no_cache else args.cache
+        if cachedir:
+            os.makedirs(cachedir, exist_ok=True)
+        B = Batch(args.input, args.jobs, cachedir,
+                  args.cache_size, args.verbose, args.binary, args.relocatable, args.optimize)
+        B.run()
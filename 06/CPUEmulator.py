@@ -0,0 +1,455 @@
+#!/opt/homebrew/bin/python3
+
+import argparse
+import hashlib
+import marshal
+import os
+import sys
+import time
+from array import array
+
+import Screen
+from Assembler import Assembler, Code, SymbolFile, loadROM
+from Profiler import FUNCTION, Profiler
+
+
+# wrap python int to signed 16-bit value of Hack register
+def wrap(x):
+    return ((x + 0x8000) & 0xFFFF) - 0x8000
+
+
+# ALU computation of each comp mnemonic, taking A, D and the RAM, M is RAM[A]
+ALU = {
+    '0': lambda a, d, ram: 0,
+    '1': lambda a, d, ram: 1,
+    '-1': lambda a, d, ram: -1,
+    'D': lambda a, d, ram: d,
+    'A': lambda a, d, ram: a,
+    'M': lambda a, d, ram: ram[a & 0x7FFF],
+    '!D': lambda a, d, ram: ~d,
+    '!A': lambda a, d, ram: ~a,
+    '!M': lambda a, d, ram: ~ram[a & 0x7FFF],
+    '-D': lambda a, d, ram: wrap(-d),
+    '-A': lambda a, d, ram: wrap(-a),
+    '-M': lambda a, d, ram: wrap(-ram[a & 0x7FFF]),
+    'D+1': lambda a, d, ram: wrap(d + 1),
+    'A+1': lambda a, d, ram: wrap(a + 1),
+    'M+1': lambda a, d, ram: wrap(ram[a & 0x7FFF] + 1),
+    'D-1': lambda a, d, ram: wrap(d - 1),
+    'A-1': lambda a, d, ram: wrap(a - 1),
+    'M-1': lambda a, d, ram: wrap(ram[a & 0x7FFF] - 1),
+    'D+A': lambda a, d, ram: wrap(d + a),
+    'D+M': lambda a, d, ram: wrap(d + ram[a & 0x7FFF]),
+    'D-A': lambda a, d, ram: wrap(d - a),
+    'D-M': lambda a, d, ram: wrap(d - ram[a & 0x7FFF]),
+    'A-D': lambda a, d, ram: wrap(a - d),
+    'M-D': lambda a, d, ram: wrap(ram[a & 0x7FFF] - d),
+    'D&A': lambda a, d, ram: d & a,
+    'D&M': lambda a, d, ram: d & ram[a & 0x7FFF],
+    'D|A': lambda a, d, ram: d | a,
+    'D|M': lambda a, d, ram: d | ram[a & 0x7FFF],
+}
+
+
+# generic ALU for comp bits outside the mnemonic table, following the zx/nx/zy/ny/f/no chip design
+def alu(comp):
+    zx, nx, zy, ny, f, no = [(comp >> (5 - i)) & 1 for i in range(6)]
+
+    def compute(a, d, ram):
+        x, y = d, ram[a & 0x7FFF] if comp & 0x40 else a
+        x = ~(0 if zx else x) if nx else (0 if zx else x)
+        y = ~(0 if zy else y) if ny else (0 if zy else y)
+        out = wrap(x + y) if f else x & y
+        return ~out if no else out
+    return compute
+
+
+# run Hack machine code, every ROM word is decoded once into flat per-address arrays
+class CPUEmulator:
+
+    def __init__(self, inputfile=None) -> None:
+        # data memory, signed words as seen by the CPU
+        self.ram = array('h', bytes(2 * 32768))
+        self.a = 0
+        self.d = 0
+        self.pc = 0
+        self.halted = False
+        self.symbol_table = {}
+        # ROM labels, from the assembled source or the .sym file next to a .hack or .rom program
+        self.labels = {}
+        if inputfile:
+            self.load(inputfile)
+
+    # load program from .hack text, packed .rom image or .asm source
+    def load(self, inputfile):
+        extension = os.path.splitext(inputfile)[1]
+        if extension == '.rom':
+            words = loadROM(inputfile)
+        elif extension == '.asm':
+            A = Assembler()
+            with open(inputfile, 'r') as f:
+                A.load(f.read())
+            A.first_pass()
+            words = A.second_pass()
+            self.symbol_table, self.labels = A.symbol_table, A.labels
+        else:
+            with open(inputfile, 'r') as f:
+                words = [int(line, 2) for line in f if line.strip()]
+        symbolfile = os.path.splitext(inputfile)[0] + '.sym'
+        if extension != '.asm' and os.path.exists(symbolfile):
+            self.labels = SymbolFile(symbolfile).labels
+        self.decode(words)
+
+    # split each word into value, ALU function, dest and jump bits
+    def decode(self, words):
+        self.rom = array('H', words)
+        size = len(self.rom)
+        # value of A_INSTRUCTION, -1 marks C_INSTRUCTION
+        self.values = array('h', [-1]) * size
+        self.comps = [None] * size
+        self.dests = array('B', bytes(size))
+        self.jumps = array('B', bytes(size))
+        # address of "(X) @X 0;JMP" loops, which end the program
+        self.halts = bytearray(size)
+        alus = {code: ALU[mnemonic] for mnemonic, code in Code.comp_dict.items()}
+        for pc, word in enumerate(self.rom):
+            if word < 0x8000:
+                self.values[pc] = word
+                continue
+            comp = (word >> 6) & 0x7F
+            self.comps[pc] = alus.get(comp) or alu(comp)
+            self.dests[pc] = (word >> 3) & 0b111
+            self.jumps[pc] = word & 0b111
+            if self.jumps[pc] == 0b111 and pc and self.values[pc - 1] == pc - 1:
+                self.halts[pc - 1] = 1
+
+    # reset registers, RAM is kept as in hardware
+    def reset(self):
+        self.a = self.d = self.pc = 0
+        self.halted = False
+
+    # execute up to cycles instructions, stop early when the program halts, returns executed count
+    def run(self, cycles):
+        ram = self.ram
+        values = self.values
+        comps = self.comps
+        dests = self.dests
+        jumps = self.jumps
+        halts = self.halts
+        a, d, pc = self.a, self.d, self.pc
+        n = 0
+        try:
+            while n < cycles:
+                n += 1
+                value = values[pc]
+                # A_INSTRUCTION
+                if value >= 0:
+                    a = value
+                    pc += 1
+                    continue
+                # C_INSTRUCTION, memory write and jump use A before it is updated
+                out = comps[pc](a, d, ram)
+                addr = a
+                dest = dests[pc]
+                if dest:
+                    if dest & 0b001:
+                        ram[addr & 0x7FFF] = out
+                    if dest & 0b010:
+                        d = out
+                    if dest & 0b100:
+                        a = out
+                jump = jumps[pc]
+                if jump and ((jump & 0b100 and out < 0) or (jump & 0b010 and out == 0) or (jump & 0b001 and out > 0)):
+                    pc = addr & 0x7FFF
+                    if halts[pc]:
+                        self.halted = True
+                        break
+                else:
+                    pc += 1
+        # running out of ROM ends the program as well
+        except IndexError:
+            self.halted = True
+            n -= 1
+        self.a, self.d, self.pc = a, d, pc
+        return n
+
+    # run as run does, reporting calls and returns of VM functions to profiler; a call is a jump to a
+    # function label that opens a new frame, its return address is read from the frame as the VM calling
+    # convention lays it out, and returning is the jump back there
+    def profile(self, cycles, profiler):
+        ram = self.ram
+        size = len(self.rom)
+        entries = {address: name for name, address in self.labels.items() if FUNCTION.match(name) and address < size}
+        halts = self.halts
+        # stops of the run loop: real halts, function entries and return addresses of open frames
+        stops = bytearray(halts)
+        for address in entries:
+            stops[address] = 1
+        # (LCL, return address) of each frame opened since profiling started
+        frames = []
+        n = 0
+        try:
+            self.halts = stops
+            while n < cycles:
+                ran = self.run(cycles - n)
+                n += ran
+                pc = self.pc
+                # nothing ran, a stop would be reported again at the same clock
+                if not ran:
+                    break
+                if pc >= size or halts[pc] or n >= cycles:
+                    break
+                self.halted = False
+                # a goto to the entry label inside the same frame is no call
+                if pc in entries and not (frames and frames[-1][0] == ram[1]):
+                    frames.append((ram[1], ram[(ram[1] - 5) & 0x7FFF] & 0x7FFF))
+                    stops[frames[-1][1]] = 1
+                    profiler.call(entries[pc], n)
+                # frames left without returning are unwound up to the one returning here
+                elif any(address == pc for _, address in frames):
+                    while frames:
+                        _, address = frames.pop()
+                        profiler.ret(n)
+                        if address == pc:
+                            break
+                    if all(address != pc for _, address in frames) and pc not in entries:
+                        stops[pc] = halts[pc]
+        finally:
+            self.halts = halts
+        return n
+
+    # current screen as 256x512 frame of 0/1 pixels
+    def frame(self):
+        return Screen.frame(self.ram)
+
+    # save current screen, format chosen by extension .png or .pbm
+    def saveScreen(self, outputfile):
+        if outputfile.endswith('.png'):
+            Screen.writePNG(self.ram, outputfile)
+        else:
+            Screen.writePBM(self.ram, outputfile)
+
+    # run the loaded program and report instructions per second
+    def benchmark(self, cycles):
+        start = time.perf_counter()
+        n = self.run(cycles)
+        elapsed = time.perf_counter() - start
+        print(f'{n} instructions in {elapsed:.3f}s, {n / elapsed:,.0f} instructions per second')
+        return n / elapsed
+
+
+# Python expression of each comp mnemonic, {a} is A, {m} is RAM[A] and d is D
+EXPRESSIONS = {
+    '0': '0',
+    '1': '1',
+    '-1': '-1',
+    'D': 'd',
+    'A': '{a}',
+    'M': '{m}',
+    '!D': '~d',
+    '!A': '~{a}',
+    '!M': '~{m}',
+    '-D': '-d',
+    '-A': '-{a}',
+    '-M': '-{m}',
+    'D+1': 'd + 1',
+    'A+1': '{a} + 1',
+    'M+1': '{m} + 1',
+    'D-1': 'd - 1',
+    'A-1': '{a} - 1',
+    'M-1': '{m} - 1',
+    'D+A': 'd + {a}',
+    'D+M': 'd + {m}',
+    'D-A': 'd - {a}',
+    'D-M': 'd - {m}',
+    'A-D': '{a} - d',
+    'M-D': '{m} - d',
+    'D&A': 'd & {a}',
+    'D&M': 'd & {m}',
+    'D|A': 'd | {a}',
+    'D|M': 'd | {m}',
+}
+# python condition on ALU output o of each jump bits
+CONDITIONS = ['', 'o > 0', 'o == 0', 'o >= 0', 'o < 0', 'o != 0', 'o <= 0', '']
+
+
+# run Hack machine code as basic blocks translated into Python functions,
+# each block runs from its entry address through the first jump
+class BlockEmulator(CPUEmulator):
+
+    def __init__(self, inputfile=None, cachedir=None) -> None:
+        self.cachedir = cachedir
+        super().__init__(inputfile)
+
+    # decode as interpreter does, then pick up blocks translated by earlier runs of the same ROM
+    def decode(self, words):
+        super().decode(words)
+        self.expressions = {Code.comp_dict[mnemonic]: expression for mnemonic, expression in EXPRESSIONS.items()}
+        # entry address to block function, its instruction count and its source
+        self.blocks = {}
+        self.lengths = {}
+        self.sources = {}
+        self.namespace = {'GENERIC': {}}
+        self.translated = False
+        if self.cachedir:
+            with open(__file__, 'rb') as f:
+                key = hashlib.sha256(self.rom.tobytes() + f.read() + sys.version.encode()).hexdigest()
+            self.cachefile = os.path.join(self.cachedir, key + '.marshal')
+            if os.path.exists(self.cachefile):
+                with open(self.cachefile, 'rb') as f:
+                    self.sources, self.lengths, code = marshal.load(f)
+                exec(code, self.namespace)
+                self.blocks = {pc: self.namespace[f'b{pc}'] for pc in self.sources}
+                # cached blocks call the ALU functions of comp codes without an expression, made at translation
+                for pc, value in enumerate(self.values):
+                    comp = (self.rom[pc] >> 6) & 0x7F
+                    if value < 0 and comp not in self.expressions:
+                        self.namespace['GENERIC'][comp] = alu(comp)
+
+    # generate Python function of the block entered at pc
+    def translate(self, pc, limit=256):
+        lines = [f'def b{pc}(ram, a, d):']
+        # value of A known at translation time, None once it is computed at run time
+        known = None
+        entry = pc
+        size = len(self.rom)
+        while True:
+            value = self.values[pc]
+            if value >= 0:
+                known = value
+                pc += 1
+            else:
+                comp = (self.rom[pc] >> 6) & 0x7F
+                dest = self.dests[pc]
+                jump = self.jumps[pc]
+                a = str(known) if known is not None else 'a'
+                m = f'ram[{known & 0x7FFF}]' if known is not None else 'ram[a & 32767]'
+                if comp in self.expressions:
+                    expression = self.expressions[comp].format(a=a, m=m)
+                    # negation, increment, addition and subtraction may leave 16 bits
+                    if any(op in expression for op in '+-') and expression != '-1':
+                        expression = f'(({expression} + 32768) & 65535) - 32768'
+                else:
+                    self.namespace['GENERIC'][comp] = alu(comp)
+                    expression = f'GENERIC[{comp}]({a}, d, ram)'
+                lines.append(f'    o = {expression}')
+                # jump target and memory address are taken from A before it is written
+                target = str(known & 0x7FFF) if known is not None else 't'
+                if jump and known is None:
+                    lines.append('    t = a & 32767')
+                if dest & 0b001:
+                    lines.append(f'    {m} = o')
+                if dest & 0b010:
+                    lines.append('    d = o')
+                if dest & 0b100:
+                    lines.append('    a = o')
+                    known = None
+                pc += 1
+                if jump:
+                    a = str(known) if known is not None else 'a'
+                    if jump == 0b111:
+                        lines.append(f'    return {a}, d, {target}')
+                    else:
+                        lines.append(f'    if {CONDITIONS[jump]}:')
+                        lines.append(f'        return {a}, d, {target}')
+                        lines.append(f'    return {a}, d, {pc}')
+                    break
+            # long straight-line code and the end of ROM also end a block
+            if pc - entry >= limit or pc >= size:
+                lines.append(f'    return {known if known is not None else "a"}, d, {pc}')
+                break
+        source = '\n'.join(lines) + '\n'
+        exec(source, self.namespace)
+        self.blocks[entry] = self.namespace[f'b{entry}']
+        self.lengths[entry] = pc - entry
+        self.sources[entry] = source
+        self.translated = True
+        return self.blocks[entry]
+
+    # execute whole blocks while they fit in cycles, the interpreter finishes the rest
+    def run(self, cycles):
+        ram = self.ram
+        blocks = self.blocks
+        lengths = self.lengths
+        halts = self.halts
+        size = len(self.rom)
+        a, d, pc = self.a, self.d, self.pc
+        n = 0
+        # a block too long for the cycles left is not run, pc then is no halt reached but where to go on
+        fits = True
+        while pc < size:
+            block = blocks.get(pc) or self.translate(pc)
+            length = lengths[pc]
+            if n + length > cycles:
+                fits = False
+                break
+            a, d, pc = block(ram, a, d)
+            n += length
+            if pc < size and halts[pc]:
+                break
+        if pc >= size or (fits and halts[pc]):
+            self.halted = True
+        self.a, self.d, self.pc = a, d, pc
+        if not self.halted and n < cycles:
+            n += super().run(cycles - n)
+        return n
+
+    # store translated blocks, so later runs of the same ROM skip translation
+    def saveCache(self):
+        if not self.cachedir or not self.translated:
+            return
+        os.makedirs(self.cachedir, exist_ok=True)
+        code = compile(''.join(self.sources.values()), self.cachefile, 'exec')
+        tmp = f'{self.cachefile}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            marshal.dump((self.sources, self.lengths, code), f)
+        os.replace(tmp, self.cachefile)
+
+
+if __name__ == '__main__':
+    # parse commandline
+    parser = argparse.ArgumentParser(
+        description='Hack CPU emulator, running .hack, .rom or .asm programs headless')
+    parser.add_argument('input', help='.hack, .rom or .asm file')
+    parser.add_argument('-n', '--cycles', type=int, default=1000000,
+                        help='max number of instructions to execute')
+    parser.add_argument('-s', '--set', action='append', default=[],
+                        help='initialize RAM before running, e.g. 0=256')
+    parser.add_argument('-p', '--print', action='append', default=[],
+                        help='print RAM after running, e.g. 0 or 256:260')
+    parser.add_argument('--benchmark', action='store_true',
+                        help='report instructions per second')
+    parser.add_argument('--blocks', action='store_true',
+                        help='run basic blocks translated to Python instead of interpreting each instruction')
+    parser.add_argument('--cache', default=os.path.join(os.path.expanduser('~'), '.cache', 'hack-emulator'),
+                        help='folder of translated blocks, keyed by ROM hash')
+    parser.add_argument('--screen', help='save screen after running to .png or .pbm file')
+    parser.add_argument('--compare', help='compare screen after running with reference .gif screenshot')
+    parser.add_argument('--profile', metavar='PREFIX',
+                        help='profile cycles by VM function, saved to PREFIX.folded and PREFIX.json')
+    parser.add_argument('--symbols', help='symbol file of the program, defaults to the .sym file next to it')
+    args = parser.parse_args()
+    CPU = BlockEmulator(args.input, args.cache) if args.blocks else CPUEmulator(args.input)
+    if args.symbols:
+        CPU.labels = SymbolFile(args.symbols).labels
+    for assignment in args.set:
+        address, value = assignment.split('=')
+        CPU.ram[int(address)] = int(value)
+    if args.profile:
+        profiler = Profiler()
+        profiler.advance(CPU.profile(args.cycles, profiler))
+        profiler.report(args.profile)
+    elif args.benchmark:
+        CPU.benchmark(args.cycles)
+    else:
+        CPU.run(args.cycles)
+    for region in args.print:
+        start, _, end = region.partition(':')
+        for address in range(int(start), int(end or start) + 1):
+            print(f'RAM[{address}] = {CPU.ram[address]}')
+    if args.blocks:
+        CPU.saveCache()
+    if args.screen:
+        CPU.saveScreen(args.screen)
+    if args.compare:
+        print(f'{Screen.compareGIF(CPU.ram, args.compare):.2%} pixels differ from {args.compare}')
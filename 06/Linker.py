@@ -0,0 +1,93 @@
+#!/opt/homebrew/bin/python3
+
+import argparse
+import json
+import os
+
+from Assembler import Assembler, writeHack, writeROM, writeSymbols
+
+
+# combine relocatable .hobj objects written by Assembler into one executable program
+class Linker:
+
+    def __init__(self, inputfiles, outputfile, binary=False) -> None:
+        # file operation
+        self.inputfiles = inputfiles
+        basename = os.path.splitext(outputfile)[0]
+        self.outputfile = basename + '.hack'
+        self.symbolfile = basename + '.sym'
+        self.romfile = basename + '.rom'
+        self.binary = binary
+        # start from the predefined symbols of assembler
+        self.symbol_table = dict(Assembler().symbol_table)
+        # address track
+        self.ram_addr = 16
+        self.rom_limit = 32768
+
+    # link objects in the given order, the first one is placed at address 0
+    def link(self):
+        self.objects = []
+        for inputfile in self.inputfiles:
+            with open(inputfile, 'r') as f:
+                self.objects.append(json.load(f))
+        self.place()
+        self.allocate()
+        words = self.resolve()
+        writeSymbols(self.labels, self.variables, self.symbolfile)
+        writeHack(words, self.outputfile)
+        print('binary code saved to: ', self.outputfile)
+        if self.binary:
+            writeROM(words, self.romfile)
+            print('ROM image saved to: ', self.romfile)
+
+    # assign each object a base address and bind its exported labels
+    def place(self):
+        self.bases = []
+        self.labels = {}
+        rom_addr = 0
+        for inputfile, obj in zip(self.inputfiles, self.objects):
+            self.bases.append(rom_addr)
+            for label, offset in obj['exports'].items():
+                assert label not in self.labels, f'label {label} redefined in {inputfile}'
+                self.labels[label] = rom_addr + offset
+            rom_addr += len(obj['code'])
+        assert rom_addr <= self.rom_limit, f'program takes {rom_addr} words, exceeds ROM size'
+        self.symbol_table.update(self.labels)
+
+    # bind imported symbols not defined as label to static RAM, from address 16 onward
+    def allocate(self):
+        self.variables = {}
+        for obj in self.objects:
+            for symbol in obj['imports']:
+                if symbol not in self.symbol_table:
+                    self.symbol_table[symbol] = self.ram_addr
+                    self.variables[symbol] = self.ram_addr
+                    self.ram_addr += 1
+
+    # patch relocated and imported words with their final address
+    def resolve(self):
+        words = []
+        for base, obj in zip(self.bases, self.objects):
+            code = list(obj['code'])
+            for offset in obj['relocations']:
+                code[offset] += base
+            for symbol, offsets in obj['imports'].items():
+                for offset in offsets:
+                    code[offset] = self.symbol_table[symbol]
+            words += code
+        return words
+
+
+if __name__ == '__main__':
+    # parse commandline
+    parser = argparse.ArgumentParser(
+        description='Hack linker, from relocatable .hobj objects to binary code')
+    parser.add_argument('input', nargs='+',
+                        help='.hobj files, placed in the given order')
+    parser.add_argument('-o', '--output', required=True,
+                        help='.hack file of linked program')
+    parser.add_argument('-b', '--binary', action='store_true',
+                        help='also write packed little-endian .rom image')
+    args = parser.parse_args()
+    L = Linker(args.input, args.output, args.binary)
+    L.link()
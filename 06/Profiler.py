@@ -0,0 +1,92 @@
+# This module profiles emulated programs by function, from the call and return events
+# the emulators report, and exports collapsed stacks for flame graphs and JSON reports
+
+import json
+import re
+
+# label of a VM function entry in translated code, Class.name, statics File.i and mangled labels excluded
+FUNCTION = re.compile(r'[A-Za-z_]\w*\.[A-Za-z_]\w*$')
+
+
+# call stack of the emulated program, cycles are charged to the whole stack at every event,
+# inclusive, exclusive and per edge cycles are all derived from those stacks
+class Profiler:
+
+    def __init__(self, root='(top)') -> None:
+        self.stack = (root,)
+        self.clock = 0
+        # cycles spent with each call stack, innermost function last
+        self.stacks = {}
+        # number of calls of each (caller, callee) edge
+        self.calls = {}
+
+    # charge cycles up to clock to the current stack
+    def advance(self, clock):
+        if clock > self.clock:
+            self.stacks[self.stack] = self.stacks.get(self.stack, 0) + clock - self.clock
+            self.clock = clock
+
+    # callee entered at clock
+    def call(self, callee, clock):
+        self.advance(clock)
+        edge = (self.stack[-1], callee)
+        self.calls[edge] = self.calls.get(edge, 0) + 1
+        self.stack += (callee,)
+
+    # innermost function returned at clock, the root is never left
+    def ret(self, clock):
+        self.advance(clock)
+        if len(self.stack) > 1:
+            self.stack = self.stack[:-1]
+
+    # name to calls, inclusive and exclusive cycles, recursive frames are counted once per stack
+    def functions(self):
+        functions = {}
+        for stack, cycles in self.stacks.items():
+            for name in set(stack):
+                functions.setdefault(name, {'calls': 0, 'inclusive': 0, 'exclusive': 0})['inclusive'] += cycles
+            functions[stack[-1]]['exclusive'] += cycles
+        for (_, callee), calls in self.calls.items():
+            functions.setdefault(callee, {'calls': 0, 'inclusive': 0, 'exclusive': 0})['calls'] += calls
+        return functions
+
+    # (caller, callee) to calls and cycles spent below the edge
+    def edges(self):
+        edges = {edge: {'calls': calls, 'cycles': 0} for edge, calls in self.calls.items()}
+        for stack, cycles in self.stacks.items():
+            for edge in set(zip(stack, stack[1:])):
+                edges[edge]['cycles'] += cycles
+        return edges
+
+    # one "caller;callee;... cycles" line per stack, the input format of flamegraph.pl and speedscope
+    def writeCollapsed(self, outputfile):
+        with open(outputfile, 'w') as f:
+            for stack, cycles in sorted(self.stacks.items()):
+                f.write(f"{';'.join(stack)} {cycles}\n")
+
+    def writeJSON(self, outputfile):
+        report = {
+            'cycles': self.clock,
+            'functions': self.functions(),
+            'edges': [{'caller': caller, 'callee': callee, **counts}
+                      for (caller, callee), counts in self.edges().items()],
+        }
+        with open(outputfile, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    # table of the functions with most exclusive cycles
+    def summary(self, count=10):
+        functions = sorted(self.functions().items(), key=lambda i: i[1]['exclusive'], reverse=True)
+        lines = [f'{"function":32} {"calls":>10} {"exclusive":>12} {"inclusive":>12}']
+        for name, counts in functions[:count]:
+            share = counts['exclusive'] / self.clock if self.clock else 0
+            lines.append(f'{name:32} {counts["calls"]:>10} {counts["exclusive"]:>12} {counts["inclusive"]:>12}'
+                         f'  {share:6.1%}')
+        return '\n'.join(lines)
+
+    # write PREFIX.folded and PREFIX.json, and print the summary
+    def report(self, prefix):
+        self.writeCollapsed(prefix + '.folded')
+        self.writeJSON(prefix + '.json')
+        print(self.summary())
+        print(f'profile saved to: {prefix}.folded {prefix}.json')
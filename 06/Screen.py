@@ -0,0 +1,170 @@
+# This module exports the Hack screen, RAM[16384:24576], as frames
+# and compares them with reference screenshots
+
+import struct
+import sys
+import zlib
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# screen memory map, 256 rows of 32 words, the least significant bit is the leftmost pixel
+SCREEN = 16384
+WIDTH = 512
+HEIGHT = 256
+WORDS = WIDTH * HEIGHT // 16
+
+# byte with its bits reversed, turning Hack's leftmost-LSB order into PBM/PNG's leftmost-MSB order
+REVERSE = bytes(int(format(i, '08b')[::-1], 2) for i in range(256))
+# PNG grayscale takes 0 as black, Hack takes 1 as black
+REVERSE_INVERT = bytes(b ^ 0xFF for b in REVERSE)
+# each byte expanded to 8 pixels of 0/1, for the in-memory frame without NumPy
+EXPAND = [bytes((i >> bit) & 1 for bit in range(8)) for i in range(256)]
+
+
+# raw little-endian bytes of the screen region, 64 bytes per row
+def screenBytes(ram):
+    region = ram[SCREEN:SCREEN + WORDS]
+    if sys.byteorder == 'big':
+        region = region[:]
+        region.byteswap()
+    return region.tobytes()
+
+
+# unpack screen region to 256x512 frame of 0/1 pixels, a NumPy uint8 array when available
+def frame(ram):
+    if np is not None:
+        region = np.frombuffer(screenBytes(ram), dtype=np.uint8)
+        return np.unpackbits(region, bitorder='little').reshape(HEIGHT, WIDTH)
+    return b''.join(EXPAND[b] for b in screenBytes(ram))
+
+
+# write screen as binary PBM, bits are packed as they are in RAM
+def writePBM(ram, outputfile):
+    with open(outputfile, 'wb') as f:
+        f.write(b'P4\n%d %d\n' % (WIDTH, HEIGHT))
+        f.write(screenBytes(ram).translate(REVERSE))
+
+
+# write screen as 1-bit grayscale PNG
+def writePNG(ram, outputfile):
+    pixels = screenBytes(ram).translate(REVERSE_INVERT)
+    stride = WIDTH // 8
+    # every scanline starts with filter type 0
+    scanlines = b''.join(b'\x00' + pixels[i:i + stride] for i in range(0, len(pixels), stride))
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    with open(outputfile, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', WIDTH, HEIGHT, 1, 0, 0, 0, 0)))
+        f.write(chunk(b'IDAT', zlib.compress(scanlines)))
+        f.write(chunk(b'IEND', b''))
+
+
+# decode first image of a GIF file to (width, height, palette indices, RGB palette)
+def readGIF(giffile):
+    with open(giffile, 'rb') as f:
+        data = f.read()
+    assert data[:3] == b'GIF', 'not a GIF file'
+    flags = data[10]
+    pos = 13
+    palette = b''
+    if flags & 0x80:
+        size = 3 << ((flags & 7) + 1)
+        palette = data[pos:pos + size]
+        pos += size
+    # skip extension blocks until the image descriptor
+    while data[pos] == 0x21:
+        pos += 2
+        while data[pos]:
+            pos += data[pos] + 1
+        pos += 1
+    assert data[pos] == 0x2C, 'GIF image descriptor not found'
+    w, h, flags = struct.unpack('<HHB', data[pos + 5:pos + 10])
+    pos += 10
+    if flags & 0x80:
+        size = 3 << ((flags & 7) + 1)
+        palette = data[pos:pos + size]
+        pos += size
+    minimum = data[pos]
+    pos += 1
+    stream = bytearray()
+    while data[pos]:
+        stream += data[pos + 1:pos + 1 + data[pos]]
+        pos += data[pos] + 1
+    indices = lzw(bytes(stream), minimum, w * h)
+    # interlaced rows are stored in four passes
+    if flags & 0x40:
+        order = list(range(0, h, 8)) + list(range(4, h, 8)) + list(range(2, h, 4)) + list(range(1, h, 2))
+        rows = [None] * h
+        for i, y in enumerate(order):
+            rows[y] = indices[i * w:(i + 1) * w]
+        indices = b''.join(rows)
+    return w, h, indices, palette
+
+
+# variable code size LZW decoder of GIF image data
+def lzw(stream, minimum, count):
+    clear = 1 << minimum
+    end = clear + 1
+    output = bytearray()
+    bits = int.from_bytes(stream, 'little')
+    total = len(stream) * 8
+    pos = 0
+    size = minimum + 1
+    table = [bytes([i]) for i in range(clear)] + [b'', b'']
+    previous = None
+    while pos + size <= total and len(output) < count:
+        code = (bits >> pos) & ((1 << size) - 1)
+        pos += size
+        if code == clear:
+            table = table[:end + 1]
+            size = minimum + 1
+            previous = None
+            continue
+        if code == end:
+            break
+        if previous is None:
+            entry = table[code]
+        elif code < len(table):
+            entry = table[code]
+            table.append(previous + entry[:1])
+        else:
+            entry = previous + previous[:1]
+            table.append(entry)
+        output += entry
+        previous = entry
+        if len(table) == 1 << size and size < 12:
+            size += 1
+    return bytes(output)
+
+
+# compare screen with reference screenshot, returns ratio of differing pixels,
+# the screen is scaled onto the area that differs from the screenshot's border color
+def compareGIF(ram, giffile):
+    w, h, indices, palette = readGIF(giffile)
+    # palette index to 1 for dark color, 0 for light one
+    dark = bytes(int(0.299 * palette[i] + 0.587 * palette[i + 1] + 0.114 * palette[i + 2] < 128)
+                 for i in range(0, len(palette), 3)).ljust(256, b'\x00')
+    # bounding box of the screen area, the border color is taken from the top-left pixel
+    border = indices[:1]
+    rows = [indices[y * w:(y + 1) * w] for y in range(h)]
+    inside = [y for y in range(h) if rows[y].strip(border)]
+    top, bottom = inside[0], inside[-1] + 1
+    left = min(len(rows[y]) - len(rows[y].lstrip(border)) for y in inside)
+    right = max(len(rows[y].rstrip(border)) for y in inside)
+    box_w, box_h = right - left, bottom - top
+    reference = b''.join(rows[y][left:right] for y in range(top, bottom)).translate(dark)
+    # nearest neighbour scaling of the screen onto the box
+    ys = [y * HEIGHT // box_h for y in range(box_h)]
+    xs = [x * WIDTH // box_w for x in range(box_w)]
+    pixels = frame(ram)
+    if np is not None:
+        scaled = pixels[np.ix_(ys, xs)]
+        expected = np.frombuffer(reference, dtype=np.uint8).reshape(box_h, box_w)
+        return float(np.count_nonzero(scaled != expected)) / (box_w * box_h)
+    scaled = b''.join(bytes(pixels[y * WIDTH + x] for x in xs) for y in ys)
+    return sum(a != b for a, b in zip(scaled, reference)) / (box_w * box_h)
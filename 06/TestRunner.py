@@ -0,0 +1,460 @@
+#!/opt/homebrew/bin/python3
+
+import argparse
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from CPUEmulator import BlockEmulator
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '05'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '08'))
+from HardwareSimulator import Netlist, NetlistTooLarge, Simulator  # noqa: E402
+from VMEmulator import VMEmulator  # noqa: E402
+
+# tokens of test script: quoted string, braces, command separators and plain words
+TOKEN = re.compile(r'"[^"]*"|[{},;]|[^\s{},;]+')
+# output-list entry, e.g. RAM[0]%D2.6.2
+COLUMN = re.compile(r'(.+)%([BDXS])(\d+)\.(\d+)\.(\d+)$')
+# comparison operators of while condition
+OPERATORS = {
+    '=': lambda x, y: x == y,
+    '<>': lambda x, y: x != y,
+    '<': lambda x, y: x < y,
+    '>': lambda x, y: x > y,
+    '<=': lambda x, y: x <= y,
+    '>=': lambda x, y: x >= y,
+}
+
+
+# test script could not be run by any target, e.g. no simulator for the loaded file
+class Skipped(Exception):
+    pass
+
+
+# program under test on the CPU emulator, loaded from .asm or .hack
+class CPUTarget:
+
+    # the netlist cache and cross-check are for HDL chips only
+    def __init__(self, inputfile, cachedir=None, crosscheck=0) -> None:
+        self.cpu = BlockEmulator(inputfile)
+
+    def get(self, name):
+        if name.startswith('RAM['):
+            return self.cpu.ram[int(name[4:-1])]
+        if name.startswith('ROM['):
+            return self.cpu.rom[int(name[4:-1])]
+        return {'A': self.cpu.a, 'D': self.cpu.d, 'PC': self.cpu.pc}[name]
+
+    def set(self, name, value):
+        if name.startswith('RAM['):
+            self.cpu.ram[int(name[4:-1])] = value
+        elif name == 'A':
+            self.cpu.a = value
+        elif name == 'D':
+            self.cpu.d = value
+        elif name == 'PC':
+            self.cpu.pc = value
+            self.cpu.halted = False
+        else:
+            raise Skipped(f'can not set {name}')
+
+    # one instruction per clock cycle, executed on tock
+    def tick(self):
+        pass
+
+    def tock(self, cycles=1):
+        self.cpu.run(cycles)
+
+    def eval(self):
+        pass
+
+
+# chip under test on the HDL simulator, combinational chips are evaluated in batch:
+# every eval becomes one lane, and all lanes are computed in one bit-parallel pass when read
+class HDLTarget:
+
+    def __init__(self, inputfile, cachedir=None, crosscheck=0) -> None:
+        try:
+            self.netlist = Netlist(inputfile, cachedir=cachedir)
+        except NetlistTooLarge as e:
+            raise Skipped(str(e))
+        self.simulator = Simulator(self.netlist, crosscheck, cachedir)
+        self.batch = not self.netlist.dffs and not self.netlist.parts
+        self.interactive = any(getattr(model, 'interactive', False) for model in self.simulator.models)
+        self.inputs = {}
+        self.lanes = []
+        self.lane = 0
+        self.evaluated = True
+
+    # ROM32K load of the program file
+    def load(self, hackfile):
+        for model in self.simulator.models:
+            if type(model).__name__ == 'ROM32K':
+                return model.load(hackfile)
+        raise Skipped(f'no ROM32K in {self.netlist.name}')
+
+    # first instance of a stateful part, its output wires or its word-level model
+    def instance(self, name):
+        if name not in self.netlist.instances:
+            raise Skipped(f'no {name} in {self.netlist.name}')
+        entry = self.netlist.instances[name][0]
+        return self.simulator.models[entry] if isinstance(entry, int) else entry
+
+    def get(self, name):
+        if not self.evaluated:
+            self.simulator.run(self.lanes)
+            self.evaluated = True
+        if '[' in name:
+            name, index = name[:-1].split('[')
+            instance = self.instance(name)
+            if isinstance(instance, list):
+                return self.simulator.held(instance, self.lane)
+            value = instance.get(index or None)
+            return value - 0x10000 if value & 0x8000 else value
+        if name not in self.netlist.inputs and name not in self.netlist.outputs:
+            raise Skipped(f'no pin {name} in {self.netlist.name}')
+        return self.simulator.get(name, self.lane)
+
+    def set(self, name, value):
+        if '[' in name:
+            name, index = name[:-1].split('[')
+            instance = self.instance(name)
+            if isinstance(instance, list):
+                raise Skipped(f'can not set state of gate-level {name}')
+            instance.set(index or None, value & 0xFFFF)
+            self.simulator.eval()
+            return
+        if name not in self.netlist.inputs:
+            raise Skipped(f'can not set {name}')
+        value &= (1 << len(self.netlist.inputs[name])) - 1
+        self.inputs[name] = value
+        if not self.batch:
+            self.simulator.set(name, value)
+
+    def eval(self):
+        if self.batch:
+            self.lanes.append(dict(self.inputs))
+            self.lane = len(self.lanes) - 1
+            self.evaluated = False
+        else:
+            self.simulator.eval()
+
+    # lane of the latest eval, for an output line computed later
+    def capture(self):
+        if not self.lanes:
+            self.eval()
+        return self.lane
+
+    def select(self, lane):
+        self.lane = lane
+
+    def tick(self):
+        self.simulator.tick()
+
+    def tock(self, cycles=1):
+        for _ in range(cycles):
+            self.simulator.tock()
+
+
+# VM code on the VM emulator, loaded from a .vm file or a folder of them, one command per vmstep;
+# strict, so OS classes in the folder run their Jack code and only missing ones run natively
+class VMTarget:
+    # stack pointer and segment bases, as named by VM emulator scripts
+    POINTERS = {'sp': 0, 'local': 1, 'argument': 2, 'this': 3, 'that': 4}
+
+    def __init__(self, inputfile, cachedir=None, crosscheck=0) -> None:
+        self.vm = VMEmulator(inputfile, strict=True)
+
+    # RAM address of RAM[i], sp, local, ..., local[i], argument[i], this[i], that[i] or temp[i]
+    def address(self, name):
+        if name in self.POINTERS:
+            return self.POINTERS[name]
+        if '[' not in name:
+            raise Skipped(f'unsupported variable {name}')
+        name, index = name[:-1].split('[')
+        if name == 'RAM':
+            return int(index)
+        if name == 'temp':
+            return 5 + int(index)
+        if name not in self.POINTERS:
+            raise Skipped(f'unsupported variable {name}')
+        return self.vm.ram[self.POINTERS[name]] + int(index)
+
+    def get(self, name):
+        return self.vm.ram[self.address(name)]
+
+    def set(self, name, value):
+        self.vm.ram[self.address(name)] = value
+
+    def vmstep(self, steps=1):
+        self.vm.run(steps)
+
+
+# simulator of each loaded file, by extension, folders are loaded as VM code
+TARGETS = {
+    '.asm': CPUTarget,
+    '.hack': CPUTarget,
+    '.hdl': HDLTarget,
+    '.vm': VMTarget,
+    '': VMTarget,
+}
+
+
+# parse and execute one .tst script, comparing its output with the .cmp file line by line
+class TestScript:
+
+    def __init__(self, scriptfile, cachedir=None, crosscheck=0) -> None:
+        self.scriptfile = scriptfile
+        self.cachedir = cachedir
+        self.crosscheck = crosscheck
+        self.folder = os.path.dirname(scriptfile)
+        with open(scriptfile, 'r') as f:
+            source = f.read()
+        # trim comments
+        source = re.sub(r'/\*.*?\*/', '', source, flags=re.S)
+        source = re.sub(r'//[^\n]*', '', source)
+        self.tokens = TOKEN.findall(source)
+        self.pos = 0
+        self.commands = self.parseBlock()
+        self.target = None
+        self.columns = []
+        self.output = []
+        # lanes of output lines not written yet, for targets evaluated in batch
+        self.pending = []
+        self.compare = None
+        self.outputfile = None
+        # clock of sequential chips, shown as "t+" between tick and tock
+        self.time = 0
+        self.ticked = False
+
+    # parse commands until closing brace or end of script
+    def parseBlock(self):
+        commands = []
+        while self.pos < len(self.tokens):
+            token = self.tokens[self.pos]
+            if token == '}':
+                self.pos += 1
+                break
+            if token in (',', ';'):
+                self.pos += 1
+                continue
+            if token in ('repeat', 'while'):
+                args = self.collect()
+                self.pos += 1
+                commands.append((token, args, self.parseBlock()))
+            else:
+                args = self.collect()
+                commands.append((args[0], args[1:], None))
+        return commands
+
+    # words of one command, up to separator or brace
+    def collect(self):
+        args = []
+        while self.pos < len(self.tokens) and self.tokens[self.pos] not in (',', ';', '{', '}'):
+            args.append(self.tokens[self.pos])
+            self.pos += 1
+        return args
+
+    # run the whole script, raises AssertionError on comparison failure
+    def run(self, write=False):
+        self.execute(self.commands)
+        self.flush()
+        if write and self.outputfile:
+            with open(self.outputfile, 'w') as f:
+                f.writelines(line + '\n' for line in self.output)
+        return len(self.output)
+
+    def execute(self, commands):
+        for name, args, body in commands:
+            if name == 'repeat':
+                # endless loop belongs to interactive scripts, e.g. 04/fill/Fill.tst
+                if len(args) < 2:
+                    raise Skipped('endless repeat, interactive script')
+                count = int(args[1])
+                # a loop of bare clock cycles is handed to the target in one call
+                if all(command[0] in ('tick', 'tock', 'ticktock') for command in body) \
+                        and sum(command[0] != 'tick' for command in body) == 1:
+                    self.tock(count)
+                    continue
+                if [command[0] for command in body] == ['vmstep']:
+                    self.target.vmstep(count)
+                    continue
+                for _ in range(count):
+                    self.execute(body)
+            elif name == 'while':
+                if getattr(self.target, 'interactive', False):
+                    raise Skipped('waiting loop of interactive script')
+                variable, operator, value = args[1:4]
+                while OPERATORS[operator](self.get(variable), self.parseValue(value)):
+                    self.execute(body)
+            else:
+                self.command(name, args)
+
+    def command(self, name, args):
+        if name in ('load', 'output-list'):
+            self.flush()
+        if name == 'load':
+            inputfile = os.path.join(self.folder, args[0]) if args else self.folder
+            extension = os.path.splitext(inputfile)[1]
+            if extension not in TARGETS:
+                raise Skipped(f'no simulator for {args[0] if args else "folder"}')
+            self.target = TARGETS[extension](inputfile, self.cachedir, self.crosscheck)
+        elif name == 'ROM32K':
+            self.target.load(os.path.join(self.folder, args[1]))
+        elif name == 'output-file':
+            self.outputfile = os.path.join(self.folder, args[0])
+        elif name == 'compare-to':
+            with open(os.path.join(self.folder, args[0]), 'r') as f:
+                self.compare = f.read().splitlines()
+        elif name == 'output-list':
+            self.columns = [COLUMN.match(column).groups() for column in args]
+            self.writeLine('|' + '|'.join(self.header(column) for column in self.columns) + '|')
+        elif name == 'output':
+            if getattr(self.target, 'batch', False):
+                self.pending.append(self.target.capture())
+            else:
+                self.writeRow()
+        elif name == 'set':
+            self.target.set(args[0], self.parseValue(args[1]))
+        elif name == 'eval':
+            self.target.eval()
+        elif name == 'tick':
+            self.target.tick()
+            self.ticked = True
+        elif name == 'tock':
+            self.tock(1)
+        elif name == 'ticktock':
+            self.tock(1)
+        elif name == 'vmstep':
+            self.target.vmstep()
+        elif name in ('echo', 'clear-echo', 'breakpoint', 'clear-breakpoints'):
+            pass
+        else:
+            raise Skipped(f'unsupported command {name}')
+
+    # write output lines of the captured lanes, evaluated together on the first read
+    def flush(self):
+        for lane in self.pending:
+            self.target.select(lane)
+            self.writeRow()
+        self.pending = []
+
+    def writeRow(self):
+        self.writeLine('|' + '|'.join(self.format(column) for column in self.columns) + '|')
+
+    # advance clock by whole cycles
+    def tock(self, cycles):
+        self.target.tock(cycles)
+        self.time += cycles
+        self.ticked = False
+
+    def get(self, name):
+        if name == 'time':
+            return f'{self.time}+' if self.ticked else str(self.time)
+        return self.target.get(name)
+
+    # numbers as 10, -1, %D10, %B0101 or %XFF
+    @staticmethod
+    def parseValue(value):
+        if value.startswith('%B'):
+            number = int(value[2:], 2)
+        elif value.startswith('%X'):
+            number = int(value[2:], 16)
+        elif value.startswith('%D'):
+            number = int(value[2:])
+        else:
+            number = int(value)
+        # 16-bit patterns are stored as signed words
+        return number - 0x10000 if 0x8000 <= number <= 0xFFFF else number
+
+    # column name centered in its width, cut when too long
+    @staticmethod
+    def header(column):
+        name, _, left, width, right = column
+        size = int(left) + int(width) + int(right)
+        name = name[:size]
+        margin = size - len(name)
+        return ' ' * (margin // 2) + name + ' ' * (margin - margin // 2)
+
+    def format(self, column):
+        name, kind, left, width, right = column
+        width = int(width)
+        value = self.get(name)
+        if kind == 'S':
+            text = str(value).ljust(width)
+        elif kind == 'B':
+            text = format(value & 0xFFFF, '016b')[-width:].rjust(width, '0')
+        elif kind == 'X':
+            text = format(value & 0xFFFF, '04X')[-width:].rjust(width, '0')
+        else:
+            text = str(value).rjust(width)
+        return ' ' * int(left) + text + ' ' * int(right)
+
+    # record output line, checking it against the .cmp line, where * matches any character
+    def writeLine(self, line):
+        if self.compare is not None:
+            number = len(self.output)
+            expected = self.compare[number] if number < len(self.compare) else ''
+            matched = len(expected) == len(line) and all(e in ('*', c) for e, c in zip(expected, line))
+            assert matched, f'comparison failure at line {number + 1}:\n  expected {expected}\n  got      {line}'
+        self.output.append(line)
+
+
+# run one script in a worker process, returns (script, status, message, seconds)
+def runScript(scriptfile, write=False, cachedir=None, crosscheck=0):
+    start = time.perf_counter()
+    try:
+        lines = TestScript(scriptfile, cachedir, crosscheck).run(write)
+        status, message = 'PASS', f'{lines} lines'
+    except Skipped as e:
+        status, message = 'SKIP', str(e)
+    except AssertionError as e:
+        status, message = 'FAIL', str(e)
+    except Exception as e:
+        status, message = 'ERROR', f'{type(e).__name__}: {e}'
+    return scriptfile, status, message, time.perf_counter() - start
+
+
+# collect .tst scripts from files and folders, folders are searched recursively
+def collectScripts(inputs):
+    scripts = []
+    for input in inputs:
+        if os.path.isdir(input):
+            for root, _, files in os.walk(input):
+                scripts += sorted(os.path.join(root, file) for file in files if file.endswith('.tst'))
+        else:
+            scripts.append(input)
+    return scripts
+
+
+if __name__ == '__main__':
+    # parse commandline
+    parser = argparse.ArgumentParser(
+        description='runner of nand2tetris .tst scripts, comparing their output with .cmp files')
+    parser.add_argument('input', nargs='+', help='.tst files or folders contain .tst files')
+    parser.add_argument('-j', '--jobs', type=int, help='worker processes, default to cpu count')
+    parser.add_argument('-w', '--write', action='store_true', help='write .out file of each script')
+    parser.add_argument('--cache', default=os.path.join(os.path.expanduser('~'), '.cache', 'hack-hdl'),
+                        help='folder of compiled netlists of HDL chips')
+    parser.add_argument('--no-cache', action='store_true', help='flatten HDL chips without the cache')
+    parser.add_argument('--crosscheck', type=int, default=0, metavar='CYCLES',
+                        help='compare word-level memories with their HDL every CYCLES cycles')
+    args = parser.parse_args()
+    cachedir = None if args.no_cache else args.cache
+    scripts = collectScripts(args.input)
+    start = time.perf_counter()
+    counts = {}
+    with ProcessPoolExecutor(args.jobs) as executor:
+        for script, status, message, seconds in executor.map(runScript, scripts, [args.write] * len(scripts),
+                                                                 [cachedir] * len(scripts),
+                                                                 [args.crosscheck] * len(scripts)):
+            counts[status] = counts.get(status, 0) + 1
+            print(f'{status:5} {seconds:7.3f}s  {script}  {message}')
+    summary = ', '.join(f'{count} {status.lower()}' for status, count in sorted(counts.items()))
+    print(f'{len(scripts)} scripts in {time.perf_counter() - start:.3f}s: {summary}')
+    # failing scripts fail the run, so that it can gate CI
+    if counts.get('FAIL') or counts.get('ERROR'):
+        sys.exit(1)
@@ -0,0 +1,574 @@
+#!/opt/homebrew/bin/python3
+
+import argparse
+import os
+import sys
+import time
+from array import array
+
+from VMTranslator import Parser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "06"))
+import Screen  # noqa: E402
+from Profiler import Profiler  # noqa: E402
+
+# opcodes of decoded VM commands
+(
+    PUSH_CONSTANT,
+    PUSH_SEGMENT,
+    PUSH_FIXED,
+    POP_SEGMENT,
+    POP_FIXED,
+    ADD,
+    SUB,
+    NEG,
+    EQ,
+    GT,
+    LT,
+    AND,
+    OR,
+    NOT,
+    GOTO,
+    IF_GOTO,
+    FUNCTION,
+    CALL,
+    RETURN,
+    NATIVE,
+) = range(20)
+ARITHMETIC = {"add": ADD, "sub": SUB, "neg": NEG, "eq": EQ, "gt": GT, "lt": LT, "and": AND, "or": OR, "not": NOT}
+# segments addressed through a base register, as RAM index of the register
+BASES = {"local": 1, "argument": 2, "this": 3, "that": 4}
+# segments at fixed RAM addresses
+FIXED = {"pointer": 3, "temp": 5}
+# first RAM address of static variables, allocated in order of first use as the assembler does
+STATIC = 16
+# zero words pushed for the local variables of a function
+ZEROS = array("h", bytes(2 * 32768))
+
+
+# wrap python int to signed 16-bit value of Hack word
+def wrap(x: int) -> int:
+    return ((x + 0x8000) & 0xFFFF) - 0x8000
+
+
+# x > y and x < y of VM code, testing the wrapped difference
+def gt(x: int, y: int) -> bool:
+    return wrap(x - y) > 0
+
+
+def lt(x: int, y: int) -> bool:
+    return wrap(x - y) < 0
+
+
+# native versions of OS functions, called with the emulator and the arguments of the call; each one leaves
+# the same statics, heap and screen as the Jack version of 12/ would, comparing as VM code does, and returns
+# None to decline inputs it cannot reproduce exactly, which then run the Jack version; none of them touches RAM[0..4]
+
+
+def mathAbs(vm, x: int) -> int:
+    return x if gt(x, 0) else wrap(-x)
+
+
+# the Jack version adds shifted y for each set bit of x, wrapping as x*y does
+def mathMultiply(vm, x: int, y: int) -> int:
+    return wrap(x * y)
+
+
+# Math.divide_abs doubles y until it exceeds x, then folds back a bit of the quotient per level;
+# a chain that never exceeds x overflows the stack in Jack, so it is declined
+def divideAbs(x: int, y: int):
+    chain = [y]
+    while not gt(chain[-1], x):
+        if len(chain) > 16:
+            return None
+        chain.append(wrap(chain[-1] + chain[-1]))
+    q = 0
+    for y in reversed(chain[:-1]):
+        q = wrap(q + q) if lt(wrap(x - wrap(wrap(2 * q) * y)), y) else wrap(q + q + 1)
+    return q
+
+
+def mathDivide(vm, x: int, y: int):
+    q = divideAbs(mathAbs(vm, x), mathAbs(vm, y))
+    if q is not None and ((lt(x, 0) and gt(y, 0)) or (gt(x, 0) and lt(y, 0))):
+        return wrap(-q)
+    return q
+
+
+def mathSqrt(vm, x: int) -> int:
+    res = 0
+    for i in range(7, -1, -1):
+        if res + (1 << i) < 182 and not gt((res + (1 << i)) ** 2, x):
+            res += 1 << i
+    return res
+
+
+def mathMax(vm, a: int, b: int) -> int:
+    return a if gt(a, b) else b
+
+
+def mathMin(vm, a: int, b: int) -> int:
+    return a if lt(a, b) else b
+
+
+def memoryPeek(vm, address: int):
+    address &= 0x7FFF
+    return vm.ram[address] if address > 4 else None
+
+
+def memoryPoke(vm, address: int, value: int):
+    address &= 0x7FFF
+    if address < 5:
+        return None
+    vm.ram[address] = value
+    return 0
+
+
+# String objects hold length and chars, the array of characters, as fields 0 and 1
+def stringLength(vm, this: int) -> int:
+    return vm.ram[this]
+
+
+def stringCharAt(vm, this: int, j: int) -> int:
+    return vm.ram[(vm.ram[this + 1] + j) & 0x7FFF]
+
+
+def stringSetCharAt(vm, this: int, j: int, c: int) -> int:
+    vm.ram[(vm.ram[this + 1] + j) & 0x7FFF] = c
+    return 0
+
+
+def stringAppendChar(vm, this: int, c: int) -> int:
+    ram = vm.ram
+    ram[(ram[this + 1] + ram[this]) & 0x7FFF] = c
+    ram[this] = wrap(ram[this] + 1)
+    return this
+
+
+def stringEraseLastChar(vm, this: int) -> int:
+    ram = vm.ram
+    ram[this] = wrap(ram[this] - 1)
+    ram[(ram[this + 1] + ram[this]) & 0x7FFF] = 0
+    return 0
+
+
+def stringIntValue(vm, this: int) -> int:
+    value = 0
+    minus = stringCharAt(vm, this, 0) == 45
+    i = int(minus)
+    while lt(i, vm.ram[this]):
+        value = wrap(wrap(value * 10) + wrap(stringCharAt(vm, this, i) - 48))
+        i += 1
+    return wrap(-value) if minus else value
+
+
+# digits come from Math.divide as String.setInt_abs computes them, all of them before anything is written
+def stringSetInt(vm, this: int, value: int):
+    digits = []
+    rest = mathAbs(vm, value)
+    while True:
+        q = mathDivide(vm, rest, 10)
+        if q is None:
+            return None
+        digits.append(wrap(rest - wrap(q * 10) + 48))
+        if lt(rest, 10):
+            break
+        rest = q
+    vm.ram[this] = 0
+    if lt(value, 0):
+        stringAppendChar(vm, this, 45)
+    for c in reversed(digits):
+        stringAppendChar(vm, this, c)
+    return 0
+
+
+# color is the Screen.currColor static, black when Screen is not loaded; rectangles outside the screen
+# are declined, the Jack version writes them to whatever RAM their pixel addresses wrap to; inverted ones
+# draw nothing, as the loops of the Jack version do not run
+def screenDrawRectangle(vm, x1: int, y1: int, x2: int, y2: int):
+    if x1 > x2 or y1 > y2:
+        return 0
+    if x1 < 0 or y1 < 0 or x2 > 511 or y2 > 255:
+        return None
+    ram = vm.ram
+    color = vm.static("Screen.0")
+    color = ram[color] if color is not None else -1
+    masks = []
+    for word in range(x1 >> 4, (x2 >> 4) + 1):
+        first, last = max(x1 - 16 * word, 0), min(x2 - 16 * word, 15)
+        masks.append((word, (1 << (last + 1)) - (1 << first)))
+    for y in range(y1, y2 + 1):
+        row = 16384 + 32 * y
+        for word, mask in masks:
+            value = ram[row + word] & 0xFFFF
+            ram[row + word] = wrap(value | mask if color else value & ~mask)
+    return 0
+
+
+# draws the 9 rows and 6 columns of the character map from Output.charMaps at the cursor, Output.cursorRow
+# and cursorCol, then advances the cursor; declined when Output is not loaded
+def outputPrintChar(vm, c: int):
+    charMaps, row, col = (vm.static(f"Output.{i}") for i in range(3))
+    if charMaps is None or row is None or col is None:
+        return None
+    ram = vm.ram
+    if not (0 <= ram[row] < 23 and 0 <= ram[col] < 64):
+        return None
+    bitmap = ram[(ram[charMaps] + (0 if lt(c, 32) or gt(c, 126) else c)) & 0x7FFF]
+    color = vm.static("Screen.0")
+    if color is not None:
+        ram[color] = -1
+    word, shift = divmod(8 * ram[col], 16)
+    for i in range(9):
+        address = 16384 + 32 * (11 * ram[row] + i) + word
+        ram[address] = wrap(ram[address] | ((ram[(bitmap + i) & 0x7FFF] & 0x3F) << shift))
+    ram[col] += 1
+    if ram[col] == 64:
+        ram[col] = 0
+        ram[row] = (ram[row] + 1) % 23
+    return 0
+
+
+NATIVES = {
+    "Math.abs": mathAbs,
+    "Math.multiply": mathMultiply,
+    "Math.divide": mathDivide,
+    "Math.sqrt": mathSqrt,
+    "Math.max": mathMax,
+    "Math.min": mathMin,
+    "Memory.peek": memoryPeek,
+    "Memory.poke": memoryPoke,
+    "String.length": stringLength,
+    "String.charAt": stringCharAt,
+    "String.setCharAt": stringSetCharAt,
+    "String.appendChar": stringAppendChar,
+    "String.eraseLastChar": stringEraseLastChar,
+    "String.intValue": stringIntValue,
+    "String.setInt": stringSetInt,
+    "String.newLine": lambda vm: 128,
+    "String.backSpace": lambda vm: 129,
+    "String.doubleQuote": lambda vm: 34,
+    "Screen.drawRectangle": screenDrawRectangle,
+    "Output.printChar": outputPrintChar,
+}
+
+
+# run VM code directly, each command is decoded once into flat per-command arrays,
+# RAM holds stack, segments and statics exactly where the translated program keeps them;
+# calls of OS functions in NATIVES run natively, strict runs the loaded Jack versions instead
+# and keeps natives only for functions no loaded file defines, as the built-in OS of the course's emulator
+class VMEmulator:
+    def __init__(self, input: str = None, bootstrap: bool = False, strict: bool = False) -> None:
+        self.ram = array("h", bytes(2 * 32768))
+        self.strict = strict
+        self.pc = 0
+        self.halted = False
+        if input:
+            self.load(input)
+            self.reset(bootstrap)
+
+    # load one .vm file or every .vm file of a folder, in the order VMTranslator translates them
+    def load(self, input: str) -> None:
+        if os.path.isdir(input):
+            self.inputfiles = [os.path.join(input, file) for file in os.listdir(input) if file.endswith(".vm")]
+        else:
+            self.inputfiles = [input]
+        commands = []
+        for inputfile in self.inputfiles:
+            P = Parser(inputfile)
+            filename = os.path.basename(inputfile).split(".")[0]
+            while P.hasMoreLines():
+                P.advance()
+                command_type = P.commandType()
+                if command_type:
+                    commands.append((filename, command_type, P.arg1(command_type), P.arg2(command_type)))
+            P.file.close()
+        self.decode(commands)
+
+    # turn commands into opcode and argument arrays, with labels, functions and statics resolved;
+    # labels take no step, as in the VM emulator of the course, so they are dropped and resolve to the next command
+    def decode(self, commands: list) -> None:
+        labels = {}
+        functionName = ""
+        steps = []
+        # labels are scoped by the enclosing function, as VMTranslator mangles them
+        for command in commands:
+            _, command_type, arg1, _ = command
+            if command_type == "C_FUNCTION":
+                functionName = arg1
+            if command_type == "C_LABEL":
+                labels[f"{functionName}${arg1}" if functionName else arg1] = len(steps)
+            else:
+                steps.append(command)
+        commands = steps
+        size = len(commands)
+        self.ops = array("B", bytes(size))
+        self.args = array("i", bytes(4 * size))
+        self.args2 = array("i", bytes(4 * size))
+        # name of the function each command belongs to, and entry of each function
+        self.names = [""] * size
+        self.functions = {}
+        self.statics = {}
+        # calls of functions not defined by the loaded files, and native function of calls bound to one,
+        # by address of the call command
+        self.undefined = {}
+        self.natives = [None] * size
+        # address of commands that stop the program when jumped to: Sys.halt, "label X, goto X" loops,
+        # the end of the program, and one past it which undefined functions are called at
+        self.halts = bytearray(size + 2)
+        self.halts[size] = self.halts[size + 1] = 1
+        functionName = ""
+        for pc, (_, command_type, arg1, _) in enumerate(commands):
+            if command_type == "C_FUNCTION":
+                functionName = arg1
+                self.functions[arg1] = pc
+            self.names[pc] = functionName
+        functionName = ""
+        for pc, (filename, command_type, arg1, arg2) in enumerate(commands):
+            if command_type == "C_ARITHMETIC":
+                self.ops[pc] = ARITHMETIC[arg1]
+            elif command_type in ("C_PUSH", "C_POP"):
+                push = command_type == "C_PUSH"
+                index = int(arg2)
+                if arg1 == "constant":
+                    self.ops[pc], self.args[pc] = PUSH_CONSTANT, index
+                elif arg1 in BASES:
+                    self.ops[pc] = PUSH_SEGMENT if push else POP_SEGMENT
+                    self.args[pc], self.args2[pc] = BASES[arg1], index
+                else:
+                    if arg1 == "static":
+                        variable = f"{filename}.{index}"
+                        address = self.statics.setdefault(variable, STATIC + len(self.statics))
+                    else:
+                        address = FIXED[arg1] + index
+                    self.ops[pc], self.args[pc] = PUSH_FIXED if push else POP_FIXED, address
+            elif command_type in ("C_GOTO", "C_IF"):
+                label = f"{functionName}${arg1}" if functionName else arg1
+                self.ops[pc], self.args[pc] = GOTO if command_type == "C_GOTO" else IF_GOTO, labels[label]
+                if command_type == "C_GOTO" and labels[label] == pc:
+                    self.halts[pc] = 1
+            elif command_type == "C_FUNCTION":
+                functionName = arg1
+                self.ops[pc], self.args[pc] = FUNCTION, int(arg2)
+            elif command_type == "C_CALL":
+                if arg1 not in self.functions:
+                    self.undefined[pc] = arg1
+                self.ops[pc], self.args[pc], self.args2[pc] = CALL, self.functions.get(arg1, size + 1), int(arg2)
+                if arg1 in NATIVES and not (self.strict and arg1 in self.functions):
+                    self.ops[pc] = NATIVE
+                    self.natives[pc] = NATIVES[arg1]
+            elif command_type == "C_RETURN":
+                self.ops[pc] = RETURN
+        if "Sys.halt" in self.functions:
+            self.halts[self.functions["Sys.halt"]] = 1
+
+    # start at Sys.init if there is one, else at the first command; with bootstrap, Sys.init is called
+    # from a frame at SP=256 as the translated bootstrap code does, and returning from it ends the program
+    def reset(self, bootstrap: bool = False) -> None:
+        self.pc = self.functions.get("Sys.init", 0)
+        self.halted = bool(self.halts[self.pc])
+        if bootstrap:
+            ram = self.ram
+            ram[0] = 261
+            ram[256] = wrap(len(self.ops))
+            ram[257:261] = ram[1:5]
+            ram[1] = 261
+            ram[2] = 256
+
+    # static variable address of File.index, None when no loaded command uses it
+    def static(self, variable: str):
+        return self.statics.get(variable)
+
+    # execute up to steps VM commands, stop early when the program halts, returns executed count,
+    # a call run natively counts as one command
+    def run(self, steps: int) -> int:
+        ram = self.ram
+        ops = self.ops
+        args = self.args
+        args2 = self.args2
+        natives = self.natives
+        halts = self.halts
+        pc = self.pc
+        sp = ram[0]
+        n = 0
+        while n < steps and not halts[pc]:
+            n += 1
+            op = ops[pc]
+            x = args[pc]
+            pc += 1
+            if op == PUSH_CONSTANT:
+                ram[sp] = x
+                sp += 1
+            elif op == PUSH_SEGMENT:
+                address = (ram[x] + args2[pc - 1]) & 0x7FFF
+                ram[sp] = ram[address] if address else sp
+                sp += 1
+            elif op == PUSH_FIXED:
+                ram[sp] = ram[x]
+                sp += 1
+            elif op == POP_SEGMENT:
+                sp -= 1
+                address = (ram[x] + args2[pc - 1]) & 0x7FFF
+                ram[address] = ram[sp]
+                if not address:
+                    sp = ram[0]
+            elif op == POP_FIXED:
+                sp -= 1
+                ram[x] = ram[sp]
+            elif op == ADD:
+                sp -= 1
+                ram[sp - 1] = ((ram[sp - 1] + ram[sp] + 0x8000) & 0xFFFF) - 0x8000
+            elif op == SUB:
+                sp -= 1
+                ram[sp - 1] = ((ram[sp - 1] - ram[sp] + 0x8000) & 0xFFFF) - 0x8000
+            elif op == NEG:
+                ram[sp - 1] = ((0x8000 - ram[sp - 1]) & 0xFFFF) - 0x8000
+            # comparisons test the wrapped difference x-y, as the translated D=A-D does,
+            # arithmetic wraps inline to signed 16-bit words
+            elif op == EQ:
+                sp -= 1
+                ram[sp - 1] = -(ram[sp - 1] == ram[sp])
+            elif op == GT:
+                sp -= 1
+                ram[sp - 1] = -(((ram[sp - 1] - ram[sp] + 0x8000) & 0xFFFF) > 0x8000)
+            elif op == LT:
+                sp -= 1
+                ram[sp - 1] = -(((ram[sp - 1] - ram[sp] + 0x8000) & 0xFFFF) < 0x8000)
+            elif op == AND:
+                sp -= 1
+                ram[sp - 1] = ram[sp - 1] & ram[sp]
+            elif op == OR:
+                sp -= 1
+                ram[sp - 1] = ram[sp - 1] | ram[sp]
+            elif op == NOT:
+                ram[sp - 1] = ~ram[sp - 1]
+            elif op == GOTO:
+                pc = x
+            elif op == IF_GOTO:
+                sp -= 1
+                if ram[sp]:
+                    pc = x
+            elif op == FUNCTION:
+                ram[sp : sp + x] = ZEROS[:x]
+                sp += x
+            elif op == CALL or op == NATIVE:
+                count = args2[pc - 1]
+                if op == NATIVE:
+                    value = natives[pc - 1](self, *ram[sp - count : sp])
+                    if value is not None:
+                        sp -= count
+                        ram[sp] = wrap(value)
+                        sp += 1
+                        continue
+                # frame of return address, LCL, ARG, THIS and THAT
+                ram[sp] = wrap(pc)
+                ram[sp + 1 : sp + 5] = ram[1:5]
+                ram[2] = sp - count
+                sp += 5
+                ram[1] = sp
+                pc = x
+            elif op == RETURN:
+                frame = ram[1]
+                pc = ram[frame - 5] & 0xFFFF
+                ram[ram[2]] = ram[sp - 1]
+                sp = ram[2] + 1
+                ram[1:5] = ram[frame - 4 : frame]
+        ram[0] = sp
+        self.pc = pc
+        self.halted = bool(halts[pc])
+        if pc > len(ops):
+            # the return address in the frame tells the call site, unless the program wrote over the frame
+            caller = (ram[(ram[1] - 5) & 0x7FFF] & 0xFFFF) - 1
+            if caller in self.undefined:
+                raise RuntimeError(f"{self.names[caller]} calls undefined function {self.undefined[caller]}")
+            names = ", ".join(sorted(set(self.undefined.values())))
+            raise RuntimeError(f"call of an undefined function, one of {names}")
+        return n
+
+    # run as run does, reporting calls and returns to profiler with one cycle per VM command;
+    # the run loop stops before every call and return, which are then stepped one at a time
+    def profile(self, steps: int, profiler: Profiler) -> int:
+        halts = self.halts
+        stops = bytearray(halts)
+        for pc, op in enumerate(self.ops):
+            if op in (CALL, NATIVE, RETURN):
+                stops[pc] = 1
+        n = 0
+        try:
+            while n < steps:
+                self.halts = stops
+                n += self.run(steps - n)
+                self.halts = halts
+                pc = self.pc
+                if halts[pc] or n >= steps:
+                    break
+                if self.ops[pc] == RETURN:
+                    n += self.run(1)
+                    profiler.ret(n)
+                    continue
+                callee = self.undefined.get(pc) or self.names[self.args[pc]]
+                start = n
+                n += self.run(1)
+                # a call run natively takes its only cycle inside the callee
+                if self.pc == pc + 1:
+                    profiler.call(callee, start)
+                    profiler.ret(n)
+                else:
+                    profiler.call(callee, n)
+        finally:
+            self.halts = halts
+            self.halted = bool(halts[self.pc])
+        return n
+
+    # save current screen, format chosen by extension .png or .pbm
+    def saveScreen(self, outputfile: str) -> None:
+        if outputfile.endswith(".png"):
+            Screen.writePNG(self.ram, outputfile)
+        else:
+            Screen.writePBM(self.ram, outputfile)
+
+    # run the loaded program and report VM commands per second
+    def benchmark(self, steps: int) -> float:
+        start = time.perf_counter()
+        n = self.run(steps)
+        elapsed = time.perf_counter() - start
+        print(f"{n} VM commands in {elapsed:.3f}s, {n / elapsed:,.0f} commands per second")
+        return n / elapsed
+
+
+if __name__ == "__main__":
+    # parse commandline
+    parser = argparse.ArgumentParser(description="Jack virtual machine emulator, running VM code without translation")
+    parser.add_argument("input", help=".vm file or folder contains .vm files")
+    parser.add_argument("-b", "--bootstrap", action="store_true", help="call Sys.init from SP=256 as bootstrap code")
+    parser.add_argument("--strict", action="store_true", help="run loaded Jack versions of OS functions, not natives")
+    parser.add_argument("-n", "--steps", type=int, default=10000000, help="max number of VM commands to execute")
+    parser.add_argument("-s", "--set", action="append", default=[], help="initialize RAM before running, e.g. 0=256")
+    parser.add_argument("-p", "--print", action="append", default=[], help="print RAM after running, e.g. 0 or 256:260")
+    parser.add_argument("--benchmark", action="store_true", help="report VM commands per second")
+    parser.add_argument("--screen", help="save screen after running to .png or .pbm file")
+    parser.add_argument("--compare", help="compare screen after running with reference .gif screenshot")
+    parser.add_argument(
+        "--profile", metavar="PREFIX", help="profile VM commands by function, saved to PREFIX.folded and PREFIX.json"
+    )
+    args = parser.parse_args()
+    VME = VMEmulator(args.input, args.bootstrap, args.strict)
+    for assignment in args.set:
+        address, value = assignment.split("=")
+        VME.ram[int(address)] = int(value)
+    if args.profile:
+        profiler = Profiler(VME.names[VME.pc] if VME.pc < len(VME.names) and VME.names[VME.pc] else "(top)")
+        profiler.advance(VME.profile(args.steps, profiler))
+        profiler.report(args.profile)
+    elif args.benchmark:
+        VME.benchmark(args.steps)
+    else:
+        VME.run(args.steps)
+    for region in args.print:
+        start, _, end = region.partition(":")
+        for address in range(int(start), int(end or start) + 1):
+            print(f"RAM[{address}] = {VME.ram[address]}")
+    if args.screen:
+        VME.saveScreen(args.screen)
+    if args.compare:
+        print(f"{Screen.compareGIF(VME.ram, args.compare):.2%} pixels differ from {args.compare}")
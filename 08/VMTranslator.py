@@ -1,7 +1,9 @@
 #!/opt/homebrew/bin/python3
 
 import argparse
+import io
 import os
+import sys
 
 
 # drive the translation process
@@ -12,43 +14,205 @@ class VMTranslator:
                 os.path.join(input, file) for file in list(filter(lambda file: file.endswith(".vm"), os.listdir(input)))
             ]
             self.outputfile = os.path.join(input, os.path.basename(input) + ".asm")
+            # bootstrap code of split mode, linked in front of the per-file outputs
+            self.bootstrapfile = os.path.join(input, "Bootstrap.asm")
+            # shared routines of split compact mode, linked after the bootstrap code
+            self.routinesfile = os.path.join(input, "Routines.asm")
+            # end loop of split mode, linked after the per-file outputs as it follows the code otherwise
+            self.endfile = os.path.join(input, "End.asm")
         else:
             self.inputfiles = [input]
             self.outputfile = input.replace("vm", "asm")
+            self.bootstrapfile = os.path.join(os.path.dirname(input), "Bootstrap.asm")
+            self.routinesfile = os.path.join(os.path.dirname(input), "Routines.asm")
+            self.endfile = os.path.join(os.path.dirname(input), "End.asm")
+        # number of call, return and comparison commands translated, by command
+        self.sites = {}
+        # peephole optimizer fusing VM commands into superinstructions, hits add up over all files
+        self.optimizer = None
+        # functions reachable from the roots, all are translated when None; functions dropped so far
+        self.reachable = None
+        self.removed = set()
 
     # translate single file
-    def translate(self, bootstrap: bool, endloop: bool) -> None:
-        C = CodeWriter(self.outputfile)
+    def translate(
+        self,
+        bootstrap: bool,
+        endloop: bool,
+        split: bool = False,
+        compact: bool = False,
+        cached: bool = False,
+        optimize: bool = False,
+        roots: list = None,
+    ) -> None:
+        if optimize:
+            self.optimizer = Optimizer()
+        if roots is not None:
+            self.reachable = self.reach(["Sys.init"] + roots, bootstrap)
+        if split:
+            self.translateSplit(bootstrap, endloop, compact, cached)
+        else:
+            C = CodeWriter(self.outputfile, compact, cached)
+            self.translateAll(C, bootstrap, endloop)
+            C.close()
+            self.addSites(C)
+        if self.optimizer:
+            self.optimizer.summary()
+        if self.reachable is not None:
+            self.pruneReport(bootstrap, endloop)
+
+    # translate all input files into one code writer
+    def translateAll(self, C: "CodeWriter", bootstrap: bool, endloop: bool) -> None:
         if bootstrap:
             C.writeBootstrap()
+        for inputfile in self.inputfiles:
+            self.translateFile(inputfile, C)
+        if endloop:
+            C.endLoop()
+        C.writeRoutines()
+
+    # translate each .vm file to its own .asm, so that each can be assembled to a separate object;
+    # shared routines of compact mode go to Routines.asm, once for all objects, and the end loop to End.asm
+    def translateSplit(self, bootstrap: bool, endloop: bool, compact: bool = False, cached: bool = False) -> None:
+        if bootstrap:
+            C = CodeWriter(self.bootstrapfile, compact)
+            C.writeBootstrap()
+            C.close()
+        if endloop:
+            C = CodeWriter(self.endfile, compact)
+            C.endLoop()
+            C.close()
+        if compact:
+            C = CodeWriter(self.routinesfile, compact)
+            C.writeRoutines(C.ROUTINES)
+            C.close()
+        for inputfile in self.inputfiles:
+            C = CodeWriter(os.path.splitext(inputfile)[0] + ".asm", compact, cached)
+            self.translateFile(inputfile, C)
+            C.close()
+            self.addSites(C)
+
+    def addSites(self, C: "CodeWriter") -> None:
+        for command, count in C.sites.items():
+            self.sites[command] = self.sites.get(command, 0) + count
+
+    # print ROM words per site and cycles of the commands compact mode shares, inline against shared,
+    # and ROM words of the whole program translated both ways, then with and without the optimizer
+    def report(self, bootstrap: bool, endloop: bool) -> None:
+        print(f"{'command':8} {'sites':>6} {'inline':>7} {'shared':>7} {'routine':>8}  cycles true/false")
+        for command in CodeWriter.ROUTINES:
+            inline, shared, routine = measureWords(command, False), measureWords(command, True), measureWords(command)
+            cycles = ""
+            if command in ["eq", "gt", "lt"]:
+                cycles = "inline {}/{}, shared {}/{}".format(*measureCycles(command, False), *measureCycles(command, True))
+            print(f"{command:8} {self.sites.get(command, 0):>6} {inline:>7} {shared:>7} {routine:>8}  {cycles}")
+        inline, compact = self.measureProgram(bootstrap, endloop), self.measureProgram(bootstrap, endloop, True)
+        print(f"program takes {inline} ROM words inline, {compact} compact, {inline - compact} saved")
+        if self.optimizer:
+            optimizer = self.optimizer
+            self.optimizer = None
+            plain = self.measureProgram(bootstrap, endloop)
+            # a fresh optimizer, so that the hits already printed are not added to
+            self.optimizer = Optimizer()
+            fused = self.measureProgram(bootstrap, endloop)
+            self.optimizer = optimizer
+            print(f"optimizer saves {plain - fused} ROM words inline, {plain} without, {fused} with")
+
+    # ROM words of the whole program translated inline or compact, with the current optimizer and pruning
+    def measureProgram(self, bootstrap: bool, endloop: bool, compact: bool = False) -> int:
+        lines = capture(lambda C: self.translateAll(C, bootstrap, endloop), compact)
+        return sum(not line.startswith("(") for line in lines)
+
+    # functions reachable through call commands from the roots and from code outside functions;
+    # without bootstrap code the program starts with the first function of the first file
+    def reach(self, roots: list, bootstrap: bool) -> set:
+        calls = {"": set()}
+        first = None
         for inputfile in self.inputfiles:
             P = Parser(inputfile)
-            C.setFilename(os.path.basename(inputfile).split(".")[0])
+            functionName = ""
             while P.hasMoreLines():
                 P.advance()
-                self.command_type = P.commandType()
-                self.arg1, self.arg2 = P.arg1(self.command_type), P.arg2(self.command_type)
-                if self.command_type == "C_ARITHMETIC":
-                    C.writeArithmetic(self.arg1)
-                elif self.command_type == "C_PUSH":
-                    C.writePushPop("push", self.arg1, self.arg2)
-                elif self.command_type == "C_POP":
-                    C.writePushPop("pop", self.arg1, self.arg2)
-                elif self.command_type == "C_LABEL":
-                    C.writeLabel(self.arg1)
-                elif self.command_type == "C_GOTO":
-                    C.writeGoto(self.arg1)
-                elif self.command_type == "C_IF":
-                    C.writeIf(self.arg1)
-                elif self.command_type == "C_FUNCTION":
-                    C.writeFuntion(self.arg1, self.arg2)
-                elif self.command_type == "C_CALL":
-                    C.writeCall(self.arg1, self.arg2)
-                elif self.command_type == "C_RETURN":
-                    C.writeReturn()
-        if endloop:
-            C.endLoop()
-        C.close()
+                command_type = P.commandType()
+                if command_type == "C_FUNCTION":
+                    functionName = P.arg1(command_type)
+                    calls.setdefault(functionName, set())
+                    first = first or functionName
+                elif command_type == "C_CALL":
+                    calls.setdefault(functionName, set()).add(P.arg1(command_type))
+        reachable = set()
+        pending = [""] + roots + ([first] if first and not bootstrap else [])
+        while pending:
+            functionName = pending.pop()
+            if functionName not in reachable:
+                reachable.add(functionName)
+                pending += calls.get(functionName, set())
+        return reachable
+
+    # drop the functions of one file that are not reachable, up to the next function command
+    def prune(self, commands: list) -> list:
+        pruned = []
+        keep = True
+        for command in commands:
+            tokens = command.split()
+            if tokens[0] == "function":
+                keep = tokens[1] in self.reachable
+                if not keep:
+                    self.removed.add(tokens[1])
+            if keep:
+                pruned.append(command)
+        return pruned
+
+    # print the functions dropped and ROM words of the whole program translated with and without them
+    def pruneReport(self, bootstrap: bool, endloop: bool) -> None:
+        reachable = self.reachable
+        self.reachable = None
+        full = self.measureProgram(bootstrap, endloop)
+        self.reachable = reachable
+        pruned = self.measureProgram(bootstrap, endloop)
+        for functionName in sorted(self.removed):
+            print(f"removed: {functionName}")
+        print(f"removed {len(self.removed)} unreachable functions")
+        print(f"pruning saves {full - pruned} ROM words inline, {full} without, {pruned} with")
+
+    # translate commands of one .vm file with the given code writer
+    def translateFile(self, inputfile: str, C: "CodeWriter") -> None:
+        P = Parser(inputfile)
+        C.setFilename(os.path.basename(inputfile).split(".")[0])
+        commands = []
+        while P.hasMoreLines():
+            P.advance()
+            if P.curr_command.strip():
+                commands.append(P.curr_command)
+        if self.reachable is not None:
+            commands = self.prune(commands)
+        # the whole file is read first, so that the optimizer can rewrite sequences of commands
+        if self.optimizer:
+            commands = self.optimizer.optimize(commands)
+        for command in commands:
+            P.curr_command = command
+            self.command_type = P.commandType()
+            self.arg1, self.arg2 = P.arg1(self.command_type), P.arg2(self.command_type)
+            if self.command_type == "C_ARITHMETIC":
+                C.writeArithmetic(self.arg1)
+            elif self.command_type == "C_PUSH":
+                C.writePushPop("push", self.arg1, self.arg2)
+            elif self.command_type == "C_POP":
+                C.writePushPop("pop", self.arg1, self.arg2)
+            elif self.command_type == "C_LABEL":
+                C.writeLabel(self.arg1)
+            elif self.command_type == "C_GOTO":
+                C.writeGoto(self.arg1)
+            elif self.command_type == "C_IF":
+                C.writeIf(self.arg1)
+            elif self.command_type == "C_FUNCTION":
+                C.writeFuntion(self.arg1, self.arg2)
+            elif self.command_type == "C_CALL":
+                C.writeCall(self.arg1, self.arg2)
+            elif self.command_type == "C_RETURN":
+                C.writeReturn()
+            elif self.command_type == "C_FUSED":
+                C.writeFused(self.arg1, P.tokens[1:])
 
 
 # understand what the command seek to do
@@ -58,6 +222,9 @@ class Parser:
         self.arithmetic_commands = ["add", "sub", "neg"]
         self.comparison_commands = ["eq", "gt", "lt"]
         self.logical_commands = ["and", "or", "not"]
+        # superinstructions of the optimizer, never written in .vm files
+        self.fused_commands = ["if-eq", "if-ne", "if-gt", "if-ge", "if-lt", "if-le", "if-not"]
+        self.fused_commands += ["move", "push-true", "push-indirect", "pop-indirect", "push-direct", "pop-direct"]
 
     # check if new line exists in file stream and get it
     def hasMoreLines(self) -> bool:
@@ -105,10 +272,12 @@ class Parser:
             return "C_RETURN"
         elif self.tokens[0] == "call":
             return "C_CALL"
+        elif self.tokens[0] in self.fused_commands:
+            return "C_FUSED"
 
     # returns the first argument of current command
     def arg1(self, type) -> str:
-        if type == "C_ARITHMETIC":
+        if type in ["C_ARITHMETIC", "C_FUSED"]:
             return self.tokens[0]
         elif type in ["C_PUSH", "C_POP", "C_LABEL", "C_GOTO", "C_IF", "C_FUNCTION", "C_CALL"]:
             return self.tokens[1]
@@ -123,10 +292,110 @@ class Parser:
             return ""
 
 
+# rewrite sequences of VM commands the compiler of 11 emits into superinstructions the code writer
+# translates to shorter assembly, a rule only matches commands that no label splits
+class Optimizer:
+    # (name, pattern, replacement), {X} binds any token, a superinstruction leaves the stack, segments,
+    # THAT and temp 0 as the original sequence does
+    rules = [
+        # comparison, possibly negated, deciding a branch, from if and while statements
+        ("if-ge", ["lt", "not", "if-goto {L}"], ["if-ge {L}"]),
+        ("if-le", ["gt", "not", "if-goto {L}"], ["if-le {L}"]),
+        ("if-ne", ["eq", "not", "if-goto {L}"], ["if-ne {L}"]),
+        ("if-lt", ["lt", "if-goto {L}"], ["if-lt {L}"]),
+        ("if-gt", ["gt", "if-goto {L}"], ["if-gt {L}"]),
+        ("if-eq", ["eq", "if-goto {L}"], ["if-eq {L}"]),
+        # not x is true unless x is -1, any other condition value stays as it is
+        ("if-not", ["not", "if-goto {L}"], ["if-not {L}"]),
+        # true, as the compiler of 11 writes it and as the course compiler does
+        ("push-true", ["push constant 0", "not"], ["push-true"]),
+        ("push-true-neg", ["push constant 1", "neg"], ["push-true"]),
+        # a[i] = x stores through temp 0 and THAT, a[i] reads through THAT
+        ("pop-indirect", ["pop temp 0", "pop pointer 1", "push temp 0", "pop that 0"], ["pop-indirect"]),
+        # ahead of move, which would take the pop to temp 0 of a pushed value
+        (
+            "pop-indirect",
+            ["push {S} {I}", "pop temp 0", "pop pointer 1", "push temp 0", "pop that 0"],
+            ["push {S} {I}", "pop-indirect"],
+        ),
+        ("push-indirect", ["pop pointer 1", "push that 0"], ["push-indirect"]),
+        # let statements of a single variable or constant
+        ("move", ["push {S} {I}", "pop {T} {J}"], ["move {S} {I} {T} {J}"]),
+    ]
+    # fixed addresses of temp, pointer and static are read and written without R13
+    rules += [
+        (f"{command}-{segment}", [f"{command} {segment} {{I}}"], [f"{command}-direct {segment} {{I}}"])
+        for command in ["push", "pop"]
+        for segment in ["temp", "pointer", "static"]
+    ]
+
+    def __init__(self) -> None:
+        self.hits = {rule[0]: 0 for rule in self.rules}
+        self.commands = 0
+        self.fused = 0
+
+    # rewrite commands of one file until no rule matches, stepping back so that a rewrite can enable another one
+    def optimize(self, commands: list) -> list:
+        commands = [command.split() for command in commands]
+        self.commands += len(commands)
+        i = 0
+        while i < len(commands):
+            replaced = self.rewrite(commands, i)
+            i = max(i - 3, 0) if replaced else i + 1
+        self.fused += len(commands)
+        return [" ".join(command) for command in commands]
+
+    # try each rule at position i of commands, rewrite commands in place
+    def rewrite(self, commands: list, i: int) -> bool:
+        for name, pattern, replacement in self.rules:
+            bindings = self.match(pattern, commands[i : i + len(pattern)])
+            if bindings is None:
+                continue
+            commands[i : i + len(pattern)] = [command.format(**bindings).split() for command in replacement]
+            self.hits[name] += 1
+            return True
+        return False
+
+    # match commands against pattern, returns bindings of placeholders or None
+    def match(self, pattern: list, commands: list) -> dict:
+        if len(commands) != len(pattern):
+            return None
+        bindings = {}
+        for tokens, command in zip(pattern, commands):
+            tokens = tokens.split()
+            if len(tokens) != len(command):
+                return None
+            for token, word in zip(tokens, command):
+                if not token.startswith("{"):
+                    if token != word:
+                        return None
+                elif bindings.setdefault(token[1:-1], word) != word:
+                    return None
+        return bindings
+
+    # hits of each rule, and VM commands before and after fusing
+    def summary(self) -> None:
+        for name, hit in self.hits.items():
+            print(f"{name}: {hit}")
+        print(f"optimizer fused {self.commands} VM commands into {self.fused}")
+
+
 # translate understood command to desired operation in hack lang
 class CodeWriter:
-    def __init__(self, outputfile: str) -> None:
+    # labels of the routines shared by all call sites, returns and comparisons in compact mode
+    ROUTINES = {"call": "VM$CALL", "return": "VM$RETURN", "eq": "VM$EQ", "gt": "VM$GT", "lt": "VM$LT"}
+
+    def __init__(self, outputfile: str, compact: bool = False, cached: bool = False) -> None:
         self.outputfile = outputfile
+        # compact mode trades a few cycles per call and return for ROM size
+        self.compact = compact
+        # cached mode keeps the stack top in D between commands, held tells whether it is there now,
+        # SP then points at the top instead of past it
+        self.cached = cached
+        self.held = False
+        self.routines = set()
+        self.sites = {}
+        self.ended = False
         self.file = open(self.outputfile, "w")
         self.segmentMap = {
             # segmantation register, support index
@@ -152,6 +421,16 @@ class CodeWriter:
             "gt": "JGT",
             "lt": "JLT",
         }
+        # jumps of the fused comparisons and conditions of the optimizer, taken on D = x - y or D = x + 1
+        self.branch_instruction = {
+            "if-eq": "JEQ",
+            "if-ne": "JNE",
+            "if-gt": "JGT",
+            "if-ge": "JGE",
+            "if-lt": "JLT",
+            "if-le": "JLE",
+            "if-not": "JNE",
+        }
         self.functionName = ""
 
     # current file being processed
@@ -166,40 +445,46 @@ class CodeWriter:
     def writeArithmetic(self, command: str) -> None:
         self.writeLine(" ".join(["//", command]))
         if command == "add":
-            self.popD()
+            self.takeD()
             self.popA()
             self.writeLine("D=D+A")
-            self.pushD()
+            self.cacheD()
         elif command == "sub":
-            self.popD()
+            self.takeD()
             self.popA()
             self.writeLine("AD=A-D")
-            self.pushD()
+            self.cacheD()
         elif command == "neg":
-            self.popD()
+            self.takeD()
             self.writeLine("D=-D")
-            self.pushD()
+            self.cacheD()
         elif command in ["eq", "gt", "lt"]:
-            self.comparison(self.comparison_instruction[command])
+            self.sites[command] = self.sites.get(command, 0) + 1
+            if self.compact:
+                self.sharedComparison(command)
+            else:
+                self.comparison(self.comparison_instruction[command])
         elif command == "and":
-            self.popD()
+            self.takeD()
             self.popA()
             self.writeLine("D=D&A")
-            self.pushD()
+            self.cacheD()
         elif command == "or":
-            self.popD()
+            self.takeD()
             self.popA()
             self.writeLine("D=D|A")
-            self.pushD()
+            self.cacheD()
         elif command == "not":
-            self.popD()
+            self.takeD()
             self.writeLine("D=!D")
-            self.pushD()
+            self.cacheD()
 
     # write to outputfile the hack code that implements the given push/pop command
     def writePushPop(self, command: str, segment: str, index: str) -> None:
         self.writeLine(" ".join(["//", command, segment, index]))
-        if command == "push":
+        if self.cached:
+            self.writeCachedPushPop(command, segment, index)
+        elif command == "push":
             if segment == "constant":
                 self.pushValue(index)
             else:
@@ -214,16 +499,88 @@ class CodeWriter:
             self.writeLine("A=M")
             self.writeLine("M=D")
 
+    # push or pop with the stack top cached in D, fixed addresses and small offsets from a segment
+    # base are addressed directly, so the value in D survives; larger offsets go through R13
+    def writeCachedPushPop(self, command: str, segment: str, index: str) -> None:
+        if command == "push":
+            self.flush()
+            self.loadD(segment, index)
+            self.cacheD()
+        elif self.direct(segment, index):
+            self.takeD()
+            self.storeD(segment, index)
+        else:
+            self.flush()
+            self.getAddress(self.segmentMap[segment], index)
+            self.popD()
+            self.writeLine("@R13")
+            self.writeLine("A=M")
+            self.writeLine("M=D")
+
+    # write assembly code that effects a superinstruction of the optimizer
+    def writeFused(self, command: str, args: list) -> None:
+        self.writeLine(" ".join(["//", command] + args))
+        if command in self.branch_instruction:
+            mangled_label = f"{self.functionName}${args[0]}" if self.functionName else args[0]
+            self.takeD()
+            if command == "if-not":
+                # not x is nonzero unless x is -1
+                self.writeLine("D=D+1")
+            else:
+                self.popA()
+                self.writeLine("D=A-D")
+            self.writeLine("@" + mangled_label)
+            self.writeLine("D;" + self.branch_instruction[command])
+        elif command == "move":
+            source, i, destination, j = args
+            if not self.direct(destination, j):
+                self.writePushPop("push", source, i)
+                self.writePushPop("pop", destination, j)
+                return
+            self.flush()
+            self.loadD(source, i)
+            self.storeD(destination, j)
+        elif command == "push-true":
+            self.flush()
+            self.writeLine("D=-1")
+            self.cacheD()
+        elif command == "push-indirect":
+            # THAT = address, then its value replaces it on the stack
+            self.takeD()
+            self.writeLine("@THAT")
+            self.writeLine("M=D")
+            self.writeLine("A=D")
+            self.writeLine("D=M")
+            self.cacheD()
+        elif command == "pop-indirect":
+            # temp 0 = value, THAT = address below it, then the value is stored through THAT
+            self.takeD()
+            self.writeLine("@5")
+            self.writeLine("M=D")
+            self.popD()
+            self.writeLine("@THAT")
+            self.writeLine("M=D")
+            self.writeLine("@5")
+            self.writeLine("D=M")
+            self.writeLine("@THAT")
+            self.writeLine("A=M")
+            self.writeLine("M=D")
+        elif command in ["push-direct", "pop-direct"]:
+            self.writeCachedPushPop(command.split("-")[0], *args)
+
     # write assembly code that effects the label command
     def writeLabel(self, label: str) -> None:
         mangled_label = f"{self.functionName}${label}" if self.functionName else label
         self.writeLine(" ".join(["//", "writeLabel:", mangled_label]))
+        # jumps arrive here with the stack in memory
+        self.flush()
         self.writeLine(f"({mangled_label})")
 
     # write assembly code that effects the goto command
     def writeGoto(self, label: str) -> None:
         mangled_label = f"{self.functionName}${label}" if self.functionName else label
         self.writeLine(" ".join(["//", "writeGoto:", mangled_label]))
+        self.flush()
         self.writeLine("@" + mangled_label)
         self.writeLine("0;JMP")
 
@@ -232,26 +589,43 @@ class CodeWriter:
         mangled_label = f"{self.functionName}${label}" if self.functionName else label
         self.writeLine(" ".join(["//", "writeIf:", mangled_label]))
         # check branch condition
-        self.popD()
+        self.takeD()
         self.writeLine("@" + mangled_label)
         self.writeLine("D;JNE")
 
     # write assembly code that effects the function command
     def writeFuntion(self, functionName: str, nVars: str) -> None:
         self.writeLine(" ".join(["//", "writeFunction:", functionName, nVars]))
+        self.flush()
         self.writeLine(f"({functionName})")
         self.functionName = functionName  # mangle the label name with functionName
         for _ in range(int(nVars)):
-            self.pushValue("0")
+            if self.cached:
+                self.writeCachedPushPop("push", "constant", "0")
+            else:
+                self.pushValue("0")
 
     # write assembly code that effects the call command
     def writeCall(self, functionName: str, nArgs: str) -> None:
         self.writeLine(" ".join(["//", "writeCall:", functionName, nArgs]))
+        self.flush()
         # generate return address label and push it to stack
         self.writeLine("// push return address to stack")
         label = f"ret.{self.returnCnt}"
         mangled_label = f"{self.functionName}${label}" if self.functionName else label
         self.returnCnt += 1
+        self.sites["call"] = self.sites.get("call", 0) + 1
+        if self.compact:
+            # pass nArgs + 5 in R14, callee in R13 and return address in D to the shared call routine
+            self.routines.add("call")
+            self.setReg("", str(int(nArgs) + 5), "R14")
+            self.setReg("", functionName, "R13")
+            self.writeLine("@" + mangled_label)
+            self.writeLine("D=A")
+            self.writeLine("@" + self.ROUTINES["call"])
+            self.writeLine("0;JMP")
+            self.writeLine(f"({mangled_label})")
+            return
         self.writeLine("@" + mangled_label)
         self.writeLine("D=A")
         self.pushD()
@@ -292,6 +666,17 @@ class CodeWriter:
     # write assembly code that effects the return command
     def writeReturn(self) -> None:
         self.writeLine(" ".join(["//", "writeReturn"]))
+        self.flush()
+        self.sites["return"] = self.sites.get("return", 0) + 1
+        if self.compact:
+            self.routines.add("return")
+            self.writeLine("@" + self.ROUTINES["return"])
+            self.writeLine("0;JMP")
+            return
+        self.writeReturnSequence()
+
+    # write the code of return, inline or as the shared return routine
+    def writeReturnSequence(self) -> None:
         # assign LCL to R14 as the temporary variable
         self.writeLine("// assign LCL to R14 as the temporary variable")
         self.move("LCL", "R14")
@@ -324,6 +709,67 @@ class CodeWriter:
         self.writeLine("A=M")
         self.writeLine("0;JMP")
 
+    # write the shared routines used by call sites so far, or the given ones, behind an end loop
+    # that keeps programs running off their last command out of them
+    def writeRoutines(self, routines=None) -> None:
+        routines = self.routines if routines is None else routines
+        self.flush()
+        if routines and not self.ended:
+            self.writeLine("// keep the program out of the routines")
+            self.writeLine("(VM$END)")
+            self.writeLine("@VM$END")
+            self.writeLine("0;JMP")
+        if "call" in routines:
+            self.writeLine(" ".join(["//", "writeRoutines:", self.ROUTINES["call"]]))
+            self.writeLine(f"({self.ROUTINES['call']})")
+            # push return address, then LCL, ARG, THIS and THAT of the caller
+            self.pushD()
+            for register in ["LCL", "ARG", "THIS", "THAT"]:
+                self.pushReg(register)
+            # reposition ARG to SP - (nArgs + 5) and LCL to SP
+            self.writeLine("@SP")
+            self.writeLine("D=M")
+            self.writeLine("@LCL")
+            self.writeLine("M=D")
+            self.writeLine("@R14")
+            self.writeLine("D=D-M")
+            self.writeLine("@ARG")
+            self.writeLine("M=D")
+            # transfer control to the callee
+            self.writeLine("@R13")
+            self.writeLine("A=M")
+            self.writeLine("0;JMP")
+        if "return" in routines:
+            self.writeLine(" ".join(["//", "writeRoutines:", self.ROUTINES["return"]]))
+            self.writeLine(f"({self.ROUTINES['return']})")
+            self.writeReturnSequence()
+        for command in ["eq", "gt", "lt"]:
+            if command in routines:
+                self.writeComparisonRoutine(command)
+
+    # routine comparing the two topmost values in place of them, D holds the return address;
+    # Hack's ALU has no flag to move into a register, so there is no branch-free form to emit instead
+    def writeComparisonRoutine(self, command: str) -> None:
+        label = self.ROUTINES[command]
+        self.writeLine(" ".join(["//", "writeRoutines:", label]))
+        self.writeLine(f"({label})")
+        self.writeLine("@R15")
+        self.writeLine("M=D")
+        # D = x - y, x is replaced with true and turned false unless the jump is taken
+        self.popD()
+        self.writeLine("A=A-1")
+        self.writeLine("D=M-D")
+        self.writeLine("M=-1")
+        self.writeLine(f"@{label}$RETURN")
+        self.writeLine("D;" + self.comparison_instruction[command])
+        self.writeLine("@SP")
+        self.writeLine("A=M-1")
+        self.writeLine("M=0")
+        self.writeLine(f"({label}$RETURN)")
+        self.writeLine("@R15")
+        self.writeLine("A=M")
+        self.writeLine("0;JMP")
+
     # write bootstrap code at the beginning of HACK code
     def writeBootstrap(self):
         # stack initialization
@@ -345,6 +791,26 @@ class CodeWriter:
         self.writeLine("@SP")
         self.writeLine("M=M+1")
 
+    # push D, or keep it in D as the stack top in cached mode
+    def cacheD(self) -> None:
+        if self.cached:
+            self.held = True
+        else:
+            self.pushD()
+
+    # pop the stack top into D, nothing to do when it is held there
+    def takeD(self) -> None:
+        if self.held:
+            self.held = False
+        else:
+            self.popD()
+
+    # write the stack top held in D to the stack, before D is needed for anything else
+    def flush(self) -> None:
+        if self.held:
+            self.held = False
+            self.pushD()
+
     def popD(self) -> None:
         self.writeLine("@SP")
         self.writeLine("AM=M-1")
@@ -366,7 +832,7 @@ class CodeWriter:
         self.pushD()
 
     def comparison(self, jumpInstruction: str) -> None:
-        self.popD()
+        self.takeD()
         self.popA()
         # each comparison command has two unique jump target
         self.TrueTarget = "PUSH_TRUE." + str(self.TrueCnt)
@@ -381,6 +847,16 @@ class CodeWriter:
         self.writeLine("D=A-D")
         self.writeLine("@" + self.TrueTarget)
         self.writeLine("D;" + jumpInstruction)
+        if self.cached:
+            # both branches leave their result in D as the cached stack top
+            self.writeLine("D=0")
+            self.writeLine("@" + self.afterTarget)
+            self.writeLine("0;JMP")
+            self.writeLine(f"({self.TrueTarget})")
+            self.writeLine("D=-1")
+            self.writeLine(f"({self.afterTarget})")
+            self.cacheD()
+            return
         self.pushValue("0")
         self.writeLine("@" + self.afterTarget)
         self.writeLine("0;JMP")
@@ -390,6 +866,67 @@ class CodeWriter:
         self.pushD()
         self.writeLine(f"({self.afterTarget})")
 
+    # call the shared comparison routine, one label per site for the return address
+    def sharedComparison(self, command: str) -> None:
+        self.flush()
+        self.routines.add(command)
+        self.afterTarget = "AFTER." + str(self.afterCnt)
+        if self.functionName:
+            self.afterTarget = f"{self.functionName}${self.afterTarget}"
+        self.afterCnt += 1
+        self.writeLine("@" + self.afterTarget)
+        self.writeLine("D=A")
+        self.writeLine("@" + self.ROUTINES[command])
+        self.writeLine("0;JMP")
+        self.writeLine(f"({self.afterTarget})")
+
+    # address of segment index, a fixed symbol without offset, or a segment register and its offset
+    def locate(self, segment: str, index: str) -> tuple:
+        if segment == "static":
+            return f"{self.inputfile}.{index}", None
+        elif segment in ["pointer", "temp"]:
+            return str(int(self.segmentMap[segment]) + int(index)), None
+        elif segment == "constant":
+            return None, None
+        return self.segmentMap[segment], int(index)
+
+    # whether segment index can be written without D, at a fixed address or a small offset
+    def direct(self, segment: str, index: str) -> bool:
+        _, offset = self.locate(segment, index)
+        return offset is None or offset <= 5
+
+    # read the value of segment index into D, larger offsets go through R13
+    def loadD(self, segment: str, index: str) -> None:
+        address, offset = self.locate(segment, index)
+        if segment == "constant":
+            if index in ["0", "1"]:
+                self.writeLine("D=" + index)
+            else:
+                self.writeLine("@" + index)
+                self.writeLine("D=A")
+        elif offset is None:
+            self.writeLine("@" + address)
+            self.writeLine("D=M")
+        elif offset <= 5:
+            self.writeLine("@" + address)
+            self.writeLine("A=M")
+            for _ in range(offset):
+                self.writeLine("A=A+1")
+            self.writeLine("D=M")
+        else:
+            self.getAddress(address, index)
+            self.getValue()
+
+    # write D to segment index, which must be direct
+    def storeD(self, segment: str, index: str) -> None:
+        address, offset = self.locate(segment, index)
+        self.writeLine("@" + address)
+        if offset is not None:
+            self.writeLine("A=M")
+            for _ in range(offset):
+                self.writeLine("A=A+1")
+        self.writeLine("M=D")
+
     # compute linear destination address and save it to R13
     def getAddress(self, segment: str, index: str) -> None:
         # translate static variable to assembly symbol, later allocated onward address 16 by assembler
@@ -444,16 +981,77 @@ class CodeWriter:
         self.writeLine("M=D")
 
     def endLoop(self) -> None:
+        self.flush()
+        self.ended = True
         self.writeLine("// end hack program with infinite loop")
         self.writeLine("(INF_LOOP)")
         self.writeLine("@INF_LOOP")
         self.writeLine("0;JMP")
 
     def close(self) -> None:
+        self.flush()
         self.file.close()
         print("Hack code saved to: ", self.outputfile)
 
 
+# code written by write with an in-memory code writer, without comments
+def capture(write, compact: bool = False) -> list:
+    C = CodeWriter(os.devnull, compact)
+    C.file.close()
+    C.file = io.StringIO()
+    write(C)
+    return [line for line in C.file.getvalue().splitlines() if not line.startswith("//")]
+
+
+# write one command of the kinds compact mode shares
+def writeCommand(C: "CodeWriter", command: str) -> None:
+    if command == "call":
+        C.writeCall("Main.main", "1")
+    elif command == "return":
+        C.writeReturn()
+    else:
+        C.writeArithmetic(command)
+
+
+# ROM words of one command, inline or shared, or of its shared routine when compact is None
+def measureWords(command: str, compact: bool = None) -> int:
+    if compact is None:
+
+        def write(C: "CodeWriter") -> None:
+            # the end loop guard in front of the routines is written once per program, not per routine
+            C.ended = True
+            C.writeRoutines({command})
+
+        lines = capture(write, True)
+    else:
+        lines = capture(lambda C: writeCommand(C, command), compact)
+    return sum(not line.startswith("(") for line in lines)
+
+
+# cycles of one comparison pushing true and pushing false, run on the CPU emulator of 06
+def measureCycles(command: str, compact: bool) -> tuple:
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "06"))
+    from Assembler import assemble
+    from CPUEmulator import CPUEmulator
+
+    lines = capture(lambda C: (C.writeArithmetic(command), C.endLoop(), C.writeRoutines()), compact)
+    words, symbols = assemble("\n".join(lines))
+    # the comparison ends where the end loop begins, whether it falls through or jumps there
+    end = symbols["INF_LOOP"]
+    cycles = []
+    # operands x, y making the comparison true, then false
+    for x, y in {"eq": [(1, 1), (1, 2)], "gt": [(2, 1), (1, 2)], "lt": [(1, 2), (2, 1)]}[command]:
+        CPU = CPUEmulator()
+        CPU.decode(words)
+        CPU.ram[0], CPU.ram[256], CPU.ram[257] = 258, x, y
+        n = 0
+        while CPU.pc != end and n < 1000:
+            n += CPU.run(1)
+        cycles.append(n)
+        assert CPU.pc == end and CPU.ram[0] == 257 and CPU.ram[256] == (-1 if len(cycles) == 1 else 0)
+    return tuple(cycles)
+
+
 if __name__ == "__main__":
     # parse commandline
     parser = argparse.ArgumentParser(
@@ -462,9 +1060,50 @@ if __name__ == "__main__":
     parser.add_argument("input", help=".vm file or folder contains .vm files")
     parser.add_argument("-b", "--bootstrap", action="store_true", help="add bootstrap code at begins")
     parser.add_argument("-e", "--endloop", action="store_true", help="add infinite loop code at the end")
+    parser.add_argument(
+        "-s",
+        "--split",
+        action="store_true",
+        help="write one .asm per .vm file, bootstrap goes to Bootstrap.asm, compact routines to Routines.asm "
+        "and the end loop to End.asm, linked last",
+    )
+    parser.add_argument(
+        "-c", "--compact", action="store_true", help="share call, return and comparison routines to cut ROM size"
+    )
+    parser.add_argument(
+        "-t", "--tos", action="store_true", help="keep the stack top in D between commands to save memory round trips"
+    )
+    parser.add_argument(
+        "-O",
+        "--optimize",
+        action="store_true",
+        help="fuse common VM command sequences into superinstructions, and print the hits of each rule",
+    )
+    parser.add_argument(
+        "-p",
+        "--prune",
+        action="store_true",
+        help="drop functions no call reaches from Sys.init and the roots, and print those dropped",
+    )
+    parser.add_argument(
+        "--root",
+        action="append",
+        default=[],
+        help="function kept by --prune along with those it calls, can be repeated",
+    )
+    parser.add_argument(
+        "-r", "--report", action="store_true", help="report ROM words and cycles of compact mode against inline code"
+    )
     input = parser.parse_args().input
     bootstrap = parser.parse_args().bootstrap
     endloop = parser.parse_args().endloop
+    split = parser.parse_args().split
+    compact = parser.parse_args().compact
+    cached = parser.parse_args().tos
+    optimize = parser.parse_args().optimize
+    roots = parser.parse_args().root if parser.parse_args().prune else None
     # start translation
     VMT = VMTranslator(input)
-    VMT.translate(bootstrap, endloop)
+    VMT.translate(bootstrap, endloop, split, compact, cached, optimize, roots)
+    if parser.parse_args().report:
+        VMT.report(bootstrap, endloop)
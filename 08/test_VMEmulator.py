@@ -0,0 +1,18 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from VMEmulator import VMEmulator, screenDrawRectangle  # noqa: E402
+
+
+# inverted rectangles draw nothing, as the loops of Screen.drawRectangle in Jack do not run
+def test_inverted_rectangle():
+    vm = VMEmulator()
+    vm.statics = {}
+    assert screenDrawRectangle(vm, 10, 0, 5, 0) == 0
+    assert screenDrawRectangle(vm, 0, 10, 5, 0) == 0
+    assert not any(vm.ram[16384:24576])
+    # black by default, bits 5 to 10 of the first word
+    assert screenDrawRectangle(vm, 5, 0, 10, 0) == 0
+    assert vm.ram[16384] == 0b11111100000
@@ -0,0 +1,12 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from VMTranslator import measureCycles  # noqa: E402
+
+
+# cycles of lt pushing true and false, from popping the operands up to the command after the comparison
+def test_comparison_cycles():
+    assert measureCycles("lt", False) == (15, 18)
+    assert measureCycles("lt", True) == (17, 20)